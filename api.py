@@ -3,6 +3,7 @@
 from flask import Flask
 from flask_cors import CORS, cross_origin
 import urllib.parse
+import os
 
 
 # import centralized modules
@@ -21,6 +22,7 @@ from blueprints.auth import auth_bp
 from blueprints.guests import guests_bp
 from blueprints.establishments import establishments_bp
 from blueprints.branches import branches_bp
+from blueprints.nearby import nearby_bp
 from blueprints.queues import queues_bp
 from blueprints.tokens import tokens_bp
 from blueprints.ratings import ratings_bp
@@ -29,6 +31,20 @@ from blueprints.feedback import feedback_bp
 from blueprints.contact_messages import contact_messages_bp
 from blueprints.covid_infections import covid_infections_bp
 from blueprints.otp import otp_bp
+from blueprints.exports import exports_bp
+from blueprints.metrics import metrics_bp
+
+# import command line interface
+from commands import export_cli, archive_tokens_command
+
+# import archival of the finished tokens
+import token_archive
+
+# import per-request SQL instrumentation
+import sql_stats
+
+# import metrics
+import metrics
 
 
 # configure database URI
@@ -59,6 +75,15 @@ app.config['SQLALCHEMY_DATABASE_URI'] = "mssql+pyodbc:///?odbc_connect=%s" % par
 app.config['SQLALCHEMY_COMMIT_ON_TEARDOWN'] = True
 app.config['SECRET_KEY'] = "cM9s$AZTdeZs5Yt"
 app.config['CORS_HEADERS'] = 'Content-Type'
+# queue operations engine:
+# 'mssql' => SQL Server stored procedures (ServeGuest, DequeueGuest, CloseQueue)
+# 'sqlalchemy' => portable implementation (any database)
+app.config['QUEUE_ENGINE'] = os.environ.get('QUEUE_ENGINE', 'mssql')
+
+# SQL statements per request above which a warning is logged:
+app.config['SQL_QUERY_BUDGET'] = int(os.environ.get('SQL_QUERY_BUDGET', 10))
+sql_stats.init_app(app)
+metrics.init_app(app)
 
 # initialize JWT
 app.config['JWT_SECRET_KEY'] = '5GNVM9McWdtnN778Fhmj'  # Change this!
@@ -71,10 +96,17 @@ app.register_blueprint(auth_bp)
 app.register_blueprint(guests_bp)
 app.register_blueprint(establishments_bp)
 app.register_blueprint(branches_bp)
+app.register_blueprint(nearby_bp)
 app.register_blueprint(queues_bp)
 app.register_blueprint(tokens_bp)
 app.register_blueprint(covid_infections_bp)
 app.register_blueprint(otp_bp)
+app.register_blueprint(exports_bp)
+app.register_blueprint(metrics_bp)
+
+# register commands
+app.cli.add_command(export_cli)
+app.cli.add_command(archive_tokens_command)
 
 
 # TODO: Implement the following blueprints:
@@ -87,3 +119,6 @@ app.register_blueprint(otp_bp)
 # extensions
 db.app = app
 db.init_app(app)
+
+# background jobs (started by the first request, not by the 'flask' commands)
+token_archive.init_app(app)
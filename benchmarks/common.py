@@ -0,0 +1,110 @@
+# Shared helpers for the benchmark scripts.
+#
+# The benchmarks run the Flask app against a local SQLite database instead of
+# the Azure SQL database, so they can be run on a laptop:
+#   python benchmarks/<benchmark>.py
+
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import event
+
+# make the API modules importable when running 'python benchmarks/x.py'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# no background archival while measuring
+os.environ.setdefault('TOKEN_ARCHIVE_INTERVAL', '0')
+
+# never send real SMS messages from a benchmark
+os.environ.setdefault('SMS_TRANSPORT', 'fake')
+os.environ.setdefault('SMS_OUTBOX_PATH', os.path.join(
+    tempfile.mkdtemp(), 'sms_outbox.db'))
+
+
+def create_app(database_path=None):
+    """
+    Returns the Flask app bound to a fresh SQLite database.
+    """
+    import api
+    from database import db
+
+    if database_path is None:
+        database_path = os.path.join(tempfile.mkdtemp(), 'q-me-bench.db')
+
+    app = api.app
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + database_path
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # wait for the write lock instead of failing under concurrent requests:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+    # the stored procedures only exist on SQL Server:
+    app.config['QUEUE_ENGINE'] = 'sqlalchemy'
+    # every request of a benchmark comes from the same client:
+    app.config['RATE_LIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+
+    return app
+
+
+def seed(app, guests_count, queues_count=1, branch_id=1):
+    """
+    Adds 'guests_count' guests and 'queues_count' queues to the database.
+    Returns a Tuple(guest_ids, queue_ids).
+    """
+    from database import db
+    from models import Guest, Queue
+
+    with app.app_context():
+        guests = [Guest('guest{}'.format(i), '+{}'.format(i))
+                  for i in range(guests_count)]
+        queues = [Queue(branch_id, 'queue{}'.format(i), 2.0)
+                  for i in range(queues_count)]
+        db.session.add_all(guests + queues)
+        db.session.commit()
+        return ([guest.PK_Guest for guest in guests],
+                [queue.PK_Queue for queue in queues])
+
+
+class StatementCounter:
+    """
+    Counts the SQL statements (i.e., database round trips) sent to the engine
+    while used as a context manager.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def percentile(sorted_values, percent):
+    """
+    Returns the given percentile (nearest rank) of a sorted list of values.
+    """
+    if len(sorted_values) == 0:
+        return 0.0
+    rank = max(0, int(round(percent / 100.0 * len(sorted_values))) - 1)
+    return sorted_values[rank]
+
+
+def timed(fn, iterations):
+    """
+    Calls fn() 'iterations' times.
+    Returns the average duration of a call in milliseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) * 1000 / iterations
@@ -0,0 +1,102 @@
+# Check: enqueueing is race free.
+#
+# Hammers 'POST .../tokens' from THREADS threads:
+# 1. every thread enqueues the same guest at the same time (ROUNDS times,
+#    with a different guest each round): exactly one request must succeed,
+# 2. every thread enqueues a different guest: every request must succeed.
+# Then verifies that the Token table holds exactly one active token per
+# enqueued guest, and that the positions in line are 1..N.
+# Exits with status 1 if any check fails.
+#
+# Usage:
+#   python benchmarks/concurrent_enqueue.py [--threads 16] [--rounds 20]
+
+import argparse
+import sys
+import threading
+import time
+
+from common import create_app, seed
+
+TOKENS_URL = '/establishments/1/branches/1/queues/{}/tokens'
+
+
+def hammer(app, url, guest_ids):
+    """
+    Posts one enqueue per guest_id, all threads starting at the same time.
+    Returns the list of JSON responses.
+    """
+    barrier = threading.Barrier(len(guest_ids))
+    responses = [None] * len(guest_ids)
+
+    def enqueue(i):
+        client = app.test_client()
+        barrier.wait()
+        responses[i] = client.post(url, json={'guest_id': guest_ids[i]}).json
+
+    threads = [threading.Thread(target=enqueue, args=(i,)) for i in range(len(guest_ids))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app()
+    guest_ids, queue_ids = seed(app, args.rounds + args.threads, queues_count=1)
+    url = TOKENS_URL.format(queue_ids[0])
+    failures = 0
+
+    start = time.perf_counter()
+    for guest_id in guest_ids[:args.rounds]:
+        responses = hammer(app, url, [guest_id] * args.threads)
+        succeeded = [r for r in responses if r['status'] == 200]
+        if len(succeeded) != 1:
+            failures += 1
+            print('guest {}: {} successful enqueues (expected 1)'.format(
+                guest_id, len(succeeded)))
+    print('same guest x{} threads, {} rounds: {:.2f} s'.format(
+        args.threads, args.rounds, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    distinct_ids = guest_ids[args.rounds:]
+    responses = hammer(app, url, distinct_ids)
+    succeeded = [r for r in responses if r['status'] == 200]
+    if len(succeeded) != len(distinct_ids):
+        failures += 1
+        print('{}/{} distinct guests enqueued (expected all)'.format(
+            len(succeeded), len(distinct_ids)))
+    print('{} distinct guests: {:.2f} s'.format(
+        len(distinct_ids), time.perf_counter() - start))
+
+    import dal
+    from database import db
+    from models import Token
+
+    with app.app_context():
+        active = db.session.query(Token.FK_Guest, db.func.count()).filter(
+            Token.FK_Queue == queue_ids[0], Token.Status != -1).group_by(Token.FK_Guest).all()
+        duplicates = [(guest_id, count) for guest_id, count in active if count > 1]
+        if len(active) != len(guest_ids) or len(duplicates) > 0:
+            failures += 1
+            print('{} active guests (expected {}), duplicates: {}'.format(
+                len(active), len(guest_ids), duplicates))
+
+        positions = sorted(dal.get_position_in_line(queue_ids[0], guest_id)
+                           for guest_id in guest_ids)
+        if positions != list(range(1, len(guest_ids) + 1)):
+            failures += 1
+            print('positions in line are not 1..{}: {}'.format(len(guest_ids), positions))
+
+    print('OK' if failures == 0 else '{} check(s) failed'.format(failures))
+    sys.exit(1 if failures > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# Check: serving and dequeueing are race free.
+#
+# Enqueues ROUNDS guests, then for each round hammers 'POST .../tokens/serve'
+# from THREADS threads (exactly one request must serve the head of line), then
+# 'POST .../tokens/dequeue' (exactly one request must dequeue that guest).
+# Then verifies that every guest has been served once, in order, that nobody
+# is left being serviced, and that the queue index agrees with the database.
+# Exits with status 1 if any check fails.
+#
+# Usage:
+#   python benchmarks/concurrent_serve.py [--threads 12] [--rounds 15]
+
+import argparse
+import sys
+import threading
+import time
+
+from common import create_app, seed
+
+QUEUE_URL = '/establishments/1/branches/1/queues/{}/tokens'
+
+
+def hammer(app, url, threads_count):
+    """
+    Posts 'threads_count' requests to 'url', all threads starting at the same
+    time. Returns the list of JSON responses.
+    """
+    barrier = threading.Barrier(threads_count)
+    responses = [None] * threads_count
+
+    def post(i):
+        client = app.test_client()
+        barrier.wait()
+        responses[i] = client.post(url).json
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=12)
+    parser.add_argument('--rounds', type=int, default=15)
+    args = parser.parse_args()
+
+    app = create_app()
+    guest_ids, queue_ids = seed(app, args.rounds, queues_count=1)
+    queue_id = queue_ids[0]
+    url = QUEUE_URL.format(queue_id)
+    failures = 0
+
+    client = app.test_client()
+    for guest_id in guest_ids:
+        client.post(url, json={'guest_id': guest_id})
+
+    import dal
+    from database import db
+    from models import Token
+
+    def being_serviced():
+        with app.app_context():
+            return [row[0] for row in db.session.query(Token.FK_Guest).filter(
+                Token.FK_Queue == queue_id, Token.Status == 1).all()]
+
+    start = time.perf_counter()
+    for round_number, guest_id in enumerate(guest_ids, 1):
+        for action in ('serve', 'dequeue'):
+            responses = hammer(app, url + '/' + action, args.threads)
+            succeeded = [r for r in responses if r['status'] == 200]
+            if len(succeeded) != 1:
+                failures += 1
+                print('round {}: {} successful {}s (expected 1)'.format(
+                    round_number, len(succeeded), action))
+            serviced = being_serviced()
+            expected = [guest_id] if action == 'serve' else []
+            if serviced != expected:
+                failures += 1
+                print('round {}: guests being serviced after {}: {} (expected {})'.format(
+                    round_number, action, serviced, expected))
+    print('serve + dequeue x{} threads, {} rounds: {:.2f} s'.format(
+        args.threads, args.rounds, time.perf_counter() - start))
+
+    with app.app_context():
+        waiting = db.session.query(Token.PK_Token).filter(
+            Token.FK_Queue == queue_id, Token.Status != -1).count()
+        if waiting != 0 or dal.get_people_enqueuing_count(queue_id) != 0:
+            failures += 1
+            print('{} active tokens, {} in the queue index (expected 0)'.format(
+                waiting, dal.get_people_enqueuing_count(queue_id)))
+
+    print('OK' if failures == 0 else '{} check(s) failed'.format(failures))
+    sys.exit(1 if failures > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Benchmark: database round trips per 'tokens/info' poll.
+#
+# Compares the sequence of DAL calls the endpoint used to issue
+# (get_guest_by_id, get_queue_by_id twice, position in line, enqueue count)
+# with the fused dal.get_queue_info() behind the POST and GET endpoints.
+
+from sqlalchemy import func
+
+from common import create_app, seed, StatementCounter, timed
+
+GUESTS = 500
+ITERATIONS = 200
+
+
+def main():
+    app = create_app()
+    guest_ids, queue_ids = seed(app, GUESTS)
+    queue_id = queue_ids[0]
+
+    import dal
+    from database import db
+    from models import Guest, Queue, Token
+
+    with app.app_context():
+        for guest_id in guest_ids:
+            dal.add_token(Token(guest_id, queue_id))
+
+    guest_id = guest_ids[-1]
+    url = '/establishments/1/branches/1/queues/{}/tokens/info'.format(queue_id)
+    client = app.test_client()
+
+    def legacy_poll():
+        # same queries as the former endpoint (whose DAL lookups did not go
+        # through the entity cache); the SQL functions only exist on SQL
+        # Server, so they are emulated with equivalent COUNT queries.
+        Guest.query.filter_by(PK_Guest=guest_id).first()
+        Queue.query.filter_by(PK_Queue=queue_id).first()
+        enqueued_at = db.session.query(Token.DateAndTime).filter(
+            Token.FK_Queue == queue_id, Token.FK_Guest == guest_id).as_scalar()
+        db.session.query(func.count(Token.PK_Token)).filter(
+            Token.FK_Queue == queue_id, Token.Status == 0,
+            Token.DateAndTime <= enqueued_at).scalar()
+        Queue.query.filter_by(PK_Queue=queue_id).first().ApproximateTimeOfService
+        db.session.query(func.count(Token.PK_Token)).filter(
+            Token.FK_Queue == queue_id, Token.Status == 0).scalar()
+        db.session.remove()
+
+    def post_poll():
+        client.post(url, json={'guest_id': guest_id})
+
+    def get_poll():
+        client.get(url, query_string={'guest_id': guest_id})
+
+    print('{:<24}{:>14}{:>14}'.format('variant', 'round trips', 'ms/request'))
+    with app.app_context():
+        for name, poll in [('before (legacy calls)', legacy_poll),
+                           ('after (POST info)', post_poll),
+                           ('after (GET info)', get_poll)]:
+            # warm up (loads the queue index on the first poll)
+            poll()
+            with StatementCounter(db.engine) as counter:
+                poll()
+            duration = timed(poll, ITERATIONS)
+            print('{:<24}{:>14}{:>14.3f}'.format(name, counter.count, duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# Load test of the token lifecycle.
+#
+# Simulates GUESTS guests enqueuing in QUEUES queues through
+# 'POST .../tokens' and then polling their position through '.../tokens/info',
+# while one operator per queue calls '.../tokens/serve' and '.../tokens/dequeue'
+# until every queue is empty. Reports the throughput and the p50/p95/p99
+# latencies of every endpoint.
+#
+# Errors are responses with a status >= 400. Some are expected: 'info' polls
+# of guests that have already been served, and 'serve' calls on empty queues.
+#
+# Usage:
+#   python benchmarks/load_test.py [--guests 200] [--queues 4] [--polls 10]
+
+import argparse
+import threading
+import time
+from collections import defaultdict
+
+from common import create_app, seed, percentile
+
+TOKENS_URL = '/establishments/1/branches/1/queues/{}/tokens'
+
+
+class Recorder:
+    """
+    Collects the latency (in ms) and the outcome of every request.
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def request(self, name, send):
+        start = time.perf_counter()
+        response = send()
+        duration = (time.perf_counter() - start) * 1000
+        failed = response.status_code >= 400 or \
+            (response.json or {}).get('status', 200) >= 400
+        with self._lock:
+            self.latencies[name].append(duration)
+            if failed:
+                self.errors[name] += 1
+        return response
+
+    def report(self, elapsed):
+        print('{:<10}{:>9}{:>8}{:>10}{:>10}{:>10}{:>10}'.format(
+            'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+        for name in sorted(self.latencies):
+            latencies = sorted(self.latencies[name])
+            print('{:<10}{:>9}{:>8}{:>10.1f}{:>10.2f}{:>10.2f}{:>10.2f}'.format(
+                name, len(latencies), self.errors[name], len(latencies) / elapsed,
+                percentile(latencies, 50), percentile(latencies, 95),
+                percentile(latencies, 99)))
+
+
+def guest(app, recorder, guest_id, queue_id, polls):
+    client = app.test_client()
+    url = TOKENS_URL.format(queue_id)
+    recorder.request('enqueue', lambda: client.post(
+        url, json={'guest_id': guest_id}))
+    for _ in range(polls):
+        recorder.request('info', lambda: client.get(
+            url + '/info', query_string={'guest_id': guest_id}))
+
+
+def operator(app, recorder, queue_id, guests_done):
+    client = app.test_client()
+    url = TOKENS_URL.format(queue_id)
+    while True:
+        served = recorder.request('serve', lambda: client.post(url + '/serve'))
+        if served.json['status'] == 200:
+            recorder.request('dequeue', lambda: client.post(url + '/dequeue'))
+        elif guests_done.is_set():
+            # nobody left to serve
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--guests', type=int, default=200)
+    parser.add_argument('--queues', type=int, default=4)
+    parser.add_argument('--polls', type=int, default=10,
+                        help='number of info polls per guest')
+    args = parser.parse_args()
+
+    app = create_app()
+    guest_ids, queue_ids = seed(app, args.guests, args.queues)
+    recorder = Recorder()
+    guests_done = threading.Event()
+
+    guest_threads = [threading.Thread(target=guest, args=(
+        app, recorder, guest_id, queue_ids[i % len(queue_ids)], args.polls))
+        for i, guest_id in enumerate(guest_ids)]
+    operator_threads = [threading.Thread(target=operator, args=(
+        app, recorder, queue_id, guests_done)) for queue_id in queue_ids]
+
+    start = time.perf_counter()
+    for thread in guest_threads + operator_threads:
+        thread.start()
+    for thread in guest_threads:
+        thread.join()
+    guests_done.set()
+    for thread in operator_threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print('{} guests, {} queues, {} polls per guest: {:.2f} s'.format(
+        args.guests, args.queues, args.polls, elapsed))
+    recorder.report(elapsed)
+
+
+if __name__ == '__main__':
+    main()
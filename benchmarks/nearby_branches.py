@@ -0,0 +1,106 @@
+# Benchmark: nearest branch search.
+#
+# Adds BRANCHES branches spread over a region (about 180 x 180 km), then
+# measures 'GET /branches/nearby' lookups (through the spatial index) for
+# several radiuses, compared with a linear scan computing the distance of
+# every branch. Also checks that both return the same branches.
+#
+# Usage:
+#   python benchmarks/nearby_branches.py [--branches 50000] [--queries 500]
+
+import argparse
+import random
+import time
+
+from common import create_app, percentile
+
+# region around Beirut
+MIN_LATITUDE, MAX_LATITUDE = 33.0, 34.6
+MIN_LONGITUDE, MAX_LONGITUDE = 35.0, 36.6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--branches', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    app = create_app()
+
+    import branch_index
+    import dal
+    from database import db
+    from models import Branch
+
+    random.seed(0)
+    locations = [(random.uniform(MIN_LATITUDE, MAX_LATITUDE),
+                  random.uniform(MIN_LONGITUDE, MAX_LONGITUDE))
+                 for _ in range(args.branches)]
+    with app.app_context():
+        db.session.execute(Branch.__table__.insert(), [{
+            'FK_Establishment': 1 + i % 100,
+            'Address': 'address {}'.format(i),
+            'Email': 'branch{}@q.me'.format(i),
+            'Password': 'x',
+            'Latitude': latitude,
+            'Longitude': longitude
+        } for i, (latitude, longitude) in enumerate(locations)])
+        db.session.commit()
+
+        start = time.perf_counter()
+        dal.get_nearby_branches(33.9, 35.5, 1.0)
+        print('{} branches, index loaded in {:.0f} ms'.format(
+            args.branches, (time.perf_counter() - start) * 1000))
+
+    def linear_scan(latitude, longitude, radius):
+        results = []
+        for branch_id, (branch_latitude, branch_longitude) in enumerate(locations, 1):
+            distance = branch_index.haversine(
+                latitude, longitude, branch_latitude, branch_longitude)
+            if distance <= radius:
+                results.append((distance, branch_id))
+        results.sort()
+        return [branch_id for distance, branch_id in results]
+
+    client = app.test_client()
+    print('{:>10}{:>12}{:>14}{:>14}{:>14}{:>16}'.format(
+        'radius km', 'avg found', 'index p50 ms', 'index p95 ms', 'HTTP p50 ms', 'linear scan ms'))
+    for radius in [1.0, 5.0, 20.0]:
+        centers = [(random.uniform(MIN_LATITUDE, MAX_LATITUDE),
+                    random.uniform(MIN_LONGITUDE, MAX_LONGITUDE))
+                   for _ in range(args.queries)]
+
+        durations, found = [], 0
+        for latitude, longitude in centers:
+            start = time.perf_counter()
+            results = branch_index.get_nearby_branches(latitude, longitude, radius)
+            durations.append((time.perf_counter() - start) * 1000)
+            found += len(results)
+        durations.sort()
+
+        http_durations = []
+        for latitude, longitude in centers[:50]:
+            start = time.perf_counter()
+            client.get('/branches/nearby', query_string={
+                'lat': latitude, 'lon': longitude, 'radius': radius})
+            http_durations.append((time.perf_counter() - start) * 1000)
+        http_durations.sort()
+
+        scan_durations = []
+        for latitude, longitude in centers[:5]:
+            start = time.perf_counter()
+            expected = linear_scan(latitude, longitude, radius)
+            scan_durations.append((time.perf_counter() - start) * 1000)
+            actual = [summary['PK_Branch'] for distance, summary in
+                      branch_index.get_nearby_branches(latitude, longitude, radius)]
+            if actual != expected:
+                print('mismatch at ({}, {}) radius {}'.format(latitude, longitude, radius))
+
+        print('{:>10.0f}{:>12.1f}{:>14.3f}{:>14.3f}{:>14.3f}{:>16.1f}'.format(
+            radius, found / len(centers), percentile(durations, 50),
+            percentile(durations, 95), percentile(http_durations, 50),
+            sum(scan_durations) / len(scan_durations)))
+
+
+if __name__ == '__main__':
+    main()
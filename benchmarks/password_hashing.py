@@ -0,0 +1,92 @@
+# Benchmark: concurrent establishment logins per second.
+#
+# Every login verifies a bcrypt hash in the password hashing pool. The
+# benchmark runs LOGINS logins with an increasing number of concurrent
+# clients, then checks that a password hashed with an outdated cost factor
+# is rehashed on login.
+#
+# Usage:
+#   python benchmarks/password_hashing.py [--rounds 10] [--logins 64]
+
+import argparse
+import threading
+import time
+
+from common import create_app, percentile
+
+PASSWORD = 'benchmark-password'
+
+
+def login(client, email, latencies, lock):
+    start = time.perf_counter()
+    response = client.post('/auth/establishments',
+                           json={'email': email, 'password': PASSWORD})
+    duration = (time.perf_counter() - start) * 1000
+    assert response.json['status'] == 200, response.json
+    with lock:
+        latencies.append(duration)
+
+
+def run(app, emails, concurrency, logins):
+    latencies = []
+    lock = threading.Lock()
+
+    def client_loop(client_id):
+        client = app.test_client()
+        for i in range(client_id, logins, concurrency):
+            login(client, emails[i % len(emails)], latencies, lock)
+
+    threads = [threading.Thread(target=client_loop, args=(client_id,))
+               for client_id in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print('{:>12}{:>12.1f}{:>10.1f}{:>10.1f}'.format(
+        concurrency, logins / elapsed, percentile(latencies, 50),
+        percentile(latencies, 95)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=10,
+                        help='bcrypt cost factor')
+    parser.add_argument('--logins', type=int, default=64)
+    args = parser.parse_args()
+
+    app = create_app()
+
+    import dal
+    import passwords
+    from models import Establishment
+
+    passwords.BCRYPT_ROUNDS = args.rounds
+    hashed = passwords.hash_password(PASSWORD)
+    emails = ['e{}@q.me'.format(i) for i in range(8)]
+    with app.app_context():
+        for email in emails:
+            dal.add_establishment(Establishment('bench', 0, email, hashed))
+
+    print('bcrypt cost {}, {} hashing threads, {} logins'.format(
+        args.rounds, passwords.POOL_SIZE, args.logins))
+    print('{:>12}{:>12}{:>10}{:>10}'.format(
+        'concurrency', 'logins/s', 'p50 ms', 'p95 ms'))
+    for concurrency in [1, 2, 4, 8, 16]:
+        run(app, emails, concurrency, args.logins)
+
+    # rehash on login when the cost factor changes:
+    passwords.BCRYPT_ROUNDS = args.rounds + 1
+    login(app.test_client(), emails[0], [], threading.Lock())
+    with app.app_context():
+        new_rounds = passwords.get_rounds(
+            dal.get_establishment_by_email(emails[0]).Password)
+    print('cost factor after login with BCRYPT_ROUNDS={}: {}'.format(
+        passwords.BCRYPT_ROUNDS, new_rounds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Check: the hot lookups use the indexes declared in models.py.
+#
+# Calls the DAL functions of the hot paths against a local SQLite database,
+# captures every SQL statement they send, and prints the SQLite query plan of
+# each one. Exits with status 1 if a statement scans a whole table instead of
+# searching an index.
+#
+# Usage:
+#   python benchmarks/query_plans.py
+
+import datetime
+import re
+import sys
+
+from sqlalchemy import event
+
+from common import create_app, seed
+
+
+# 'SCAN token' (SQLite >= 3.36) or 'SCAN TABLE token', without an index
+# (but not 'SCAN anon_1', the rows of a subquery):
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?(?!anon_\d+$)\w+$')
+
+
+def capture(engine, fn):
+    """
+    Calls fn() and returns the list of Tuple(statement, parameters) it sent.
+    """
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        fn()
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+    return statements
+
+
+def main():
+    app = create_app()
+    guest_ids, queue_ids = seed(app, 10, queues_count=2)
+    queue_id, guest_id = queue_ids[0], guest_ids[0]
+
+    import dal
+    import queue_index
+    from database import db
+    from models import Branch, Establishment
+
+    with app.app_context():
+        dal.add_tokens(queue_id, guest_ids)
+        db.session.add_all([
+            Establishment('bench', 0, 'e@q.me', 'x'),
+            Branch(1, 'address', 'b@q.me', 'x')
+        ])
+        db.session.commit()
+
+    def load_queue_index():
+        queue_index.invalidate()
+        dal.get_people_enqueuing_counts(queue_ids)
+
+    yesterday = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+    checks = [
+        ('get_token', lambda: dal.get_token(queue_id, guest_id)),
+        ('get_guest_by_phone_number', lambda: dal.get_guest_by_phone_number('+1')),
+        ('get_establishment_by_email', lambda: dal.get_establishment_by_email('e@q.me')),
+        ('get_branch_by_email', lambda: dal.get_branch_by_email('b@q.me')),
+        ('get_branches', lambda: dal.get_branches(1)),
+        ('get_queues', lambda: dal.get_queues(1)),
+        ('queue index load', load_queue_index),
+        ('add_tokens', lambda: dal.add_tokens(queue_ids[1], guest_ids)),
+        ('serve_guest', lambda: dal.serve_guest(queue_id)),
+        ('dequeue_guest', lambda: dal.dequeue_guest(queue_id)),
+        ('close_queue', lambda: dal.close_queue(queue_id)),
+        ('archive_tokens_batch', lambda: dal.archive_tokens_batch(yesterday, 1000)),
+        ('iter_token_history', lambda: list(dal.iter_token_history(queue_id=queue_id))),
+        ('iter_guests', lambda: list(dal.iter_guests(queue_id=queue_id))),
+    ]
+
+    failures = 0
+    with app.app_context():
+        connection = db.engine.raw_connection()
+        try:
+            for name, fn in checks:
+                print(name)
+                for statement, parameters in capture(db.engine, fn):
+                    if not statement.lstrip().upper().startswith(
+                            ('SELECT', 'UPDATE', 'DELETE', 'INSERT')):
+                        continue
+                    plan = [row[3] for row in connection.execute(
+                        'EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()]
+                    scans = [step for step in plan if FULL_SCAN.match(step)]
+                    failures += len(scans)
+                    print('  {:<6}{}'.format(
+                        'FAIL' if scans else 'ok',
+                        ' '.join(statement.split())[:90]))
+                    for step in plan:
+                        print('        ' + step)
+        finally:
+            connection.close()
+
+    print('{} full table scan(s)'.format(failures))
+    sys.exit(1 if failures > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
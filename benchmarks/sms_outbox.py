@@ -0,0 +1,53 @@
+# Benchmark: SMS outbox throughput with a fake transport.
+#
+# Submits MESSAGES messages to an outbox backed by a temporary SQLite file and
+# measures how long the endpoints wait to submit a message, and how long the
+# worker pool takes to drain the outbox for several pool sizes.
+
+import os
+import tempfile
+import time
+
+import common  # noqa: F401 (makes the API modules importable)
+from sms_outbox import SmsOutbox, FakeTransport
+
+MESSAGES = 500
+# simulated provider latency (seconds) and failure rate:
+LATENCY = 0.05
+FAILURE_RATE = 0.05
+
+
+def run(workers):
+    path = os.path.join(tempfile.mkdtemp(), 'outbox.db')
+    transport = FakeTransport(latency=LATENCY, failure_rate=FAILURE_RATE)
+    outbox = SmsOutbox(transport, path=path, workers=workers,
+                       max_attempts=3, backoff=0.01, poll_interval=0.01,
+                       verbose=False)
+
+    start = time.perf_counter()
+    for i in range(MESSAGES):
+        outbox.submit('+{}'.format(i), 'Benchmark message #{}'.format(i))
+    submit_ms = (time.perf_counter() - start) * 1000 / MESSAGES
+
+    outbox.start()
+    while outbox.pending_count() > 0:
+        time.sleep(0.01)
+    drain_s = time.perf_counter() - start
+    outbox.stop()
+
+    print('{:>8}{:>14.3f}{:>14.2f}{:>12.1f}{:>8}{:>10}'.format(
+        workers, submit_ms, drain_s, MESSAGES / drain_s,
+        outbox.failed_attempts_count, len(outbox.dead_letters())))
+
+
+def main():
+    print('{} messages, {:.0f} ms provider latency, {:.0%} failure rate'.format(
+        MESSAGES, LATENCY * 1000, FAILURE_RATE))
+    print('{:>8}{:>14}{:>14}{:>12}{:>8}{:>10}'.format(
+        'workers', 'submit ms', 'drain s', 'msg/s', 'retries', 'dead'))
+    for workers in [1, 4, 16]:
+        run(workers)
+
+
+if __name__ == '__main__':
+    main()
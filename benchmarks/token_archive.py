@@ -0,0 +1,112 @@
+# Benchmark: lookups on the Token table vs. the size of its history.
+#
+# Fills a queue with ACTIVE waiting tokens and HISTORY finished tokens, then
+# measures the lookups that read the Token table (get_token, the position in
+# line and the count as the SQL functions compute them, and loading the queue
+# index) before and after archiving the finished tokens.
+#
+# Usage:
+#   python benchmarks/token_archive.py [--active 100] [--history 100000]
+
+import argparse
+import datetime
+import time
+
+from sqlalchemy import func
+
+from common import create_app, seed, timed
+
+ITERATIONS = 50
+
+
+def measure(app, queue_id, guest_id):
+    import dal
+    import queue_index
+    from database import db
+    from models import Token
+
+    def get_token():
+        dal.get_token(queue_id, guest_id)
+
+    def position_in_line():
+        # same query as the dbo.GetPositionInLine SQL function
+        enqueued_at = db.session.query(Token.DateAndTime).filter(
+            Token.FK_Queue == queue_id, Token.FK_Guest == guest_id,
+            Token.Status == 0).as_scalar()
+        db.session.query(func.count(Token.PK_Token)).filter(
+            Token.FK_Queue == queue_id, Token.Status == 0,
+            Token.DateAndTime <= enqueued_at).scalar()
+
+    def people_enqueuing_count():
+        # same query as the dbo.GetPeopleEnqueingCount SQL function
+        db.session.query(func.count(Token.PK_Token)).filter(
+            Token.FK_Queue == queue_id, Token.Status == 0).scalar()
+
+    def load_queue_index():
+        queue_index.invalidate(queue_id)
+        queue_index.get_position_in_line(queue_id, guest_id)
+
+    with app.app_context():
+        return [(name, timed(fn, ITERATIONS)) for name, fn in [
+            ('get_token', get_token),
+            ('position in line (SQL)', position_in_line),
+            ('people enqueuing (SQL)', people_enqueuing_count),
+            ('queue index load', load_queue_index)
+        ]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--active', type=int, default=100)
+    parser.add_argument('--history', type=int, default=100000)
+    args = parser.parse_args()
+
+    app = create_app()
+    guest_ids, queue_ids = seed(app, args.active)
+    queue_id = queue_ids[0]
+
+    import token_archive
+    from database import db
+    from models import Token, TokenHistory
+
+    with app.app_context():
+        # finished tokens of past days (of other guests and queues too):
+        two_days_ago = datetime.datetime.utcnow() - datetime.timedelta(days=2)
+        db.session.execute(Token.__table__.insert(), [{
+            'FK_Guest': 100000 + i,
+            'FK_Queue': queue_id + i % 4,
+            'Status': -1,
+            'DateAndTime': two_days_ago
+        } for i in range(args.history)])
+        # guests waiting today:
+        now = datetime.datetime.utcnow()
+        db.session.execute(Token.__table__.insert(), [{
+            'FK_Guest': guest_id,
+            'FK_Queue': queue_id,
+            'Status': 0,
+            'DateAndTime': now + datetime.timedelta(microseconds=i)
+        } for i, guest_id in enumerate(guest_ids)])
+        db.session.commit()
+
+    guest_id = guest_ids[len(guest_ids) // 2]
+    before = measure(app, queue_id, guest_id)
+
+    with app.app_context():
+        start = time.perf_counter()
+        archived_count = token_archive.archive_tokens()
+        duration = time.perf_counter() - start
+        token_count = Token.query.count()
+        history_count = TokenHistory.query.count()
+    print('archived {} tokens in {:.2f} s ({} batches of {}): Token={}, TokenHistory={}'.format(
+        archived_count, duration, -(-archived_count // token_archive.BATCH_SIZE),
+        token_archive.BATCH_SIZE, token_count, history_count))
+
+    after = measure(app, queue_id, guest_id)
+
+    print('{:<26}{:>14}{:>14}'.format('lookup', 'before (ms)', 'after (ms)'))
+    for (name, before_ms), (_, after_ms) in zip(before, after):
+        print('{:<26}{:>14.3f}{:>14.3f}'.format(name, before_ms, after_ms))
+
+
+if __name__ == '__main__':
+    main()
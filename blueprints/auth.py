@@ -9,10 +9,11 @@ from flask_jwt_extended import (
     get_jwt_identity
 )
 
-import bcrypt
+import passwords  # bcrypt hashing (off the request's thread)
 from models import Guest, Establishment, Branch
 import dal  # import data access layer
 import helpers
+import rate_limit
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -91,6 +92,8 @@ def login_guest():
 
 
 @auth_bp.route('/establishments', methods=['POST'])
+@rate_limit.limit(per_ip='20/minute', per_identity='5/minute',
+                  identity=rate_limit.json_field('email'))
 def login_establishment():
     """
     Expects the following JSON Object:
@@ -138,8 +141,15 @@ def login_establishment():
 
             if establishment_record is None:
                 error = "Establishment not registered. Please register before logging in"
-            elif not bcrypt.checkpw(establishment.Password.encode('utf-8'), establishment_record.Password.encode('utf-8')):
-                error = 'Incorrect Establishment\'s Credentials.'
+            else:
+                is_valid_password, new_hash = passwords.verify_password(
+                    establishment.Password, establishment_record.Password)
+                if not is_valid_password:
+                    error = 'Incorrect Establishment\'s Credentials.'
+                elif new_hash is not None:
+                    # cost factor has changed since the password was hashed
+                    dal.update_establishment_password(
+                        establishment_record.PK_Establishment, new_hash)
         else:
             error = is_valid_tuple[1]
 
@@ -163,6 +173,8 @@ def login_establishment():
 
 
 @auth_bp.route('/branches', methods=['POST'])
+@rate_limit.limit(per_ip='20/minute', per_identity='5/minute',
+                  identity=rate_limit.json_field('email'))
 def login_branch():
     """
     Expects the following JSON Object:
@@ -208,8 +220,14 @@ def login_branch():
 
             if branch_record is None:
                 error = "Branch not registered. Please add branch from your establishment before logging in"
-            elif not bcrypt.checkpw(branch.Password.encode('utf-8'), branch_record.Password.encode('utf-8')):
-                error = 'Incorrect Branch\'s Credentials.'
+            else:
+                is_valid_password, new_hash = passwords.verify_password(
+                    branch.Password, branch_record.Password)
+                if not is_valid_password:
+                    error = 'Incorrect Branch\'s Credentials.'
+                elif new_hash is not None:
+                    # cost factor has changed since the password was hashed
+                    dal.update_branch_password(branch_record.PK_Branch, new_hash)
         else:
             error = is_valid_tuple[1]
 
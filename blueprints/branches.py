@@ -11,7 +11,7 @@ from flask_jwt_extended import (
 from models import Branch
 import dal  # import data access layer
 import helpers
-import bcrypt
+import passwords  # bcrypt hashing (off the request's thread)
 import custom_decorator
 
 branches_bp = Blueprint('branches', __name__, url_prefix='/establishments')
@@ -24,11 +24,15 @@ branches_bp = Blueprint('branches', __name__, url_prefix='/establishments')
 def get_branches(establishment_id):
     """
     Does not expect any JSON object.
+    Accepts the optional '?limit=' and '?after=' query string parameters
+    (pass the 'next_cursor' of a page as 'after' to get the next page).
+    Without them, every item is returned (and next_cursor is null).
 
     Returns the following JSON Object if operation is successful:
     {
         "status" : 200,
-        "message" : branches_list
+        "message" : branches_list,
+        "next_cursor" : (int) /* null on the last page */
     }
     """
     @after_this_request
@@ -36,11 +40,15 @@ def get_branches(establishment_id):
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response
 
-    branches_list = dal.get_branches(establishment_id)
+    limit, after = helpers.get_page_args(request)
+    branches_list, next_cursor = helpers.get_page(
+        dal.get_branches(establishment_id, helpers.get_fetch_limit(limit), after), limit,
+        lambda branch: branch.PK_Branch)
     if len(branches_list) > 0:
         return jsonify(
             status=200,
-            message=[branch.serialize() for branch in branches_list]
+            message=[branch.serialize() for branch in branches_list],
+            next_cursor=next_cursor
         )
     else:
         return jsonify(
@@ -112,8 +120,7 @@ def add_branch(establishment_id):
     if not helpers.request_is_valid(request, keys_list=['address', 'email', 'password']):
         error = "Invalid JSON Object."
 
-    password = bcrypt.hashpw(request.json.get(
-        'password').encode('utf-8'), bcrypt.gensalt())
+    password = passwords.hash_password(request.json.get('password'))
 
     if error is None:
         # map json object to class object
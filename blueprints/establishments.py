@@ -24,11 +24,15 @@ establishments_bp = Blueprint(
 def get_establishments():
     """
     Does not expect any JSON object.
+    Accepts the optional '?limit=' and '?after=' query string parameters
+    (pass the 'next_cursor' of a page as 'after' to get the next page).
+    Without them, every item is returned (and next_cursor is null).
 
     Returns the following JSON Object if operation is successful:
     {
         "status" : 200,
-        "message" : establishments_list
+        "message" : establishments_list,
+        "next_cursor" : (int) /* null on the last page */
     }
     """
     @after_this_request
@@ -36,12 +40,16 @@ def get_establishments():
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response
 
-    establishments_list = dal.get_establishments()
+    limit, after = helpers.get_page_args(request)
+    establishments_list, next_cursor = helpers.get_page(
+        dal.get_establishments(helpers.get_fetch_limit(limit), after), limit,
+        lambda establishment: establishment.PK_Establishment)
     if len(establishments_list) > 0:
         return jsonify(
             status=200,
             message=[establishment.serialize()
-                     for establishment in establishments_list]
+                     for establishment in establishments_list],
+            next_cursor=next_cursor
         )
     else:
         return jsonify(
@@ -0,0 +1,57 @@
+from flask import (
+    Blueprint, request, jsonify, after_this_request, Response,
+    stream_with_context
+)
+from flask_jwt_extended import jwt_required
+
+import exports  # import NDJSON exports
+
+exports_bp = Blueprint('exports', __name__, url_prefix='/exports')
+
+
+# GET:
+
+@exports_bp.route('/<string:name>', methods=['GET'])
+@jwt_required()
+def export(name):
+    """
+    Exports the guests, tokens, archived tokens or queues:
+    GET /exports/guests | /exports/tokens | /exports/token_history | /exports/queues
+
+    Accepts the following optional query string parameters:
+    ?queue_id=(int)&branch_id=(int)&since=(ISO 8601 date)&until=(ISO 8601 date)
+
+    Returns an NDJSON stream (one JSON object per line) if operation is successful.
+    """
+    @after_this_request
+    def add_header(response):
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response
+
+    # initially, assume that there is no error
+    error = None
+
+    if name not in exports.EXPORTS:
+        error = "Unknown export '{}' (must be one of: {}).".format(
+            name, ', '.join(sorted(exports.EXPORTS)))
+    else:
+        try:
+            since = exports.parse_date(request.args.get('since'))
+            until = exports.parse_date(request.args.get('until'))
+        except ValueError:
+            error = "Invalid date (must be in the ISO 8601 format, e.g. 2021-05-01)."
+
+    if error is None:
+        lines = exports.generate_ndjson(
+            name,
+            queue_id=request.args.get('queue_id', type=int),
+            branch_id=request.args.get('branch_id', type=int),
+            since=since,
+            until=until
+        )
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+    else:
+        return jsonify(
+            status=400,
+            message=error
+        )
@@ -22,11 +22,15 @@ guests_bp = Blueprint('guests', __name__, url_prefix='/guests')
 def get_guests():
     """
     Does not expect any JSON object.
+    Accepts the optional '?limit=' and '?after=' query string parameters
+    (pass the 'next_cursor' of a page as 'after' to get the next page).
+    Without them, every item is returned (and next_cursor is null).
 
     Returns the following JSON Object if operation is successful:
     {
         "status" : 200,
-        "message" : guests_list
+        "message" : guests_list,
+        "next_cursor" : (int) /* null on the last page */
     }
     """
     @after_this_request
@@ -34,11 +38,15 @@ def get_guests():
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response
 
-    guests_list = dal.get_guests()
+    limit, after = helpers.get_page_args(request)
+    guests_list, next_cursor = helpers.get_page(
+        dal.get_guests(helpers.get_fetch_limit(limit), after), limit,
+        lambda guest: guest.PK_Guest)
     if len(guests_list) > 0:
         return jsonify(
             status=200,
-            message=[guest.serialize() for guest in guests_list]
+            message=[guest.serialize() for guest in guests_list],
+            next_cursor=next_cursor
         )
     else:
         return jsonify(
@@ -0,0 +1,17 @@
+from flask import (
+    Blueprint, Response
+)
+
+import metrics  # import metrics of the API
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+# GET:
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Returns the metrics of the API in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
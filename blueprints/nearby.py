@@ -0,0 +1,86 @@
+from flask import (
+    Blueprint, request, jsonify, after_this_request
+)
+
+import dal  # import data access layer
+
+nearby_bp = Blueprint('nearby', __name__, url_prefix='/branches')
+
+# search radius (in km) when '?radius=' is not specified, and maximum radius
+DEFAULT_RADIUS = 5.0
+MAX_RADIUS = 100.0
+# maximum number of branches returned when '?limit=' is not specified
+DEFAULT_LIMIT = 50
+
+
+# GET:
+
+@nearby_bp.route('/nearby', methods=['GET'])
+def get_nearby_branches():
+    """
+    Does not expect any JSON object.
+    Expects the following query string parameters:
+    ?lat=(float)&lon=(float)&radius=(float, in km, optional)&limit=(int, optional)
+
+    Returns the following JSON Object if operation is successful
+    (branches sorted by distance):
+    {
+        "status" : 200,
+        "message" : [
+            {
+                "PK_Branch" : (int),
+                "FK_Establishment" : (int),
+                "Address" : (str),
+                "PhoneNumber" : (str),
+                "Latitude" : (float),
+                "Longitude" : (float),
+                "distance" : (float) /* in km */
+            },
+            ...
+        ]
+    }
+    """
+    @after_this_request
+    def add_header(response):
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response
+
+    # initially, assume that there is no error
+    error = None
+
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lon', type=float)
+    radius = request.args.get('radius', DEFAULT_RADIUS, type=float)
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+
+    if latitude is None or not -90 <= latitude <= 90:
+        error = "Latitude is invalid (must be a float between -90 and 90)."
+    elif longitude is None or not -180 <= longitude <= 180:
+        error = "Longitude is invalid (must be a float between -180 and 180)."
+    elif radius is None or not 0 < radius <= MAX_RADIUS:
+        error = "Radius is invalid (must be a float between 0 and {} km).".format(MAX_RADIUS)
+    elif limit is None or limit < 1:
+        error = "Limit is invalid (must be a positive integer)."
+
+    if error is None:
+        branches_list = []
+        for distance, summary in dal.get_nearby_branches(latitude, longitude, radius, limit):
+            branch = dict(summary)
+            branch['distance'] = round(distance, 3)
+            branches_list.append(branch)
+
+        if len(branches_list) > 0:
+            return jsonify(
+                status=200,
+                message=branches_list
+            )
+        else:
+            return jsonify(
+                status=404,
+                message="No Branch found within {} km!".format(radius)
+            )
+    else:
+        return jsonify(
+            status=400,
+            message=error
+        )
@@ -8,11 +8,13 @@ from flask_jwt_extended import (
 
 import json
 import bcrypt
-from models import Guest, OTP
+from models import Guest
 import dal  # import data access layer
 import helpers
 import sms
 import random
+import otp_store
+import rate_limit
 
 
 otp_bp = Blueprint('otp', __name__, url_prefix='/otp')
@@ -36,6 +38,11 @@ def add_otp():
     # verify JSON
     if not helpers.request_is_valid(request, keys_list=['guest_id', 'otp']):
         error = "Invalid JSON Object."
+    else:
+        try:
+            guest_id = otp_store.guest_key(request.json.get('guest_id'))
+        except ValueError:
+            error = "'guest_id' must be an integer."
 
     if error is None:
         # hash otp
@@ -43,14 +50,8 @@ def add_otp():
         #     'otp').encode('utf-8'), bcrypt.gensalt())
         unhashed_otp_value = request.json.get('otp')
 
-        # map json object to class object
-        otp = OTP(
-            request.json.get('guest_id'),
-            unhashed_otp_value
-        )
-
-        # add to db:
-        dal.add_otp(otp)
+        # add to the OTP store (expires after otp_store.TTL seconds):
+        otp_store.get_store().put(guest_id, unhashed_otp_value)
 
         return jsonify(status=200,
                        message="OTP added sucessfully")
@@ -60,6 +61,8 @@ def add_otp():
 
 
 @otp_bp.route('/check', methods=['POST'])
+@rate_limit.limit(per_ip='30/minute', per_identity='10/minute',
+                  identity=rate_limit.json_field('guest_id'))
 def check_otp():
     """
     Expects the follwoing JSON obj:
@@ -75,12 +78,22 @@ def check_otp():
         return response
 
     result = False
-    guest_id = request.json.get("guest_id")
+    try:
+        guest_id = otp_store.guest_key(request.json.get("guest_id"))
+    except ValueError:
+        return jsonify(result=result,
+                       message="'guest_id' must be an integer.",
+                       status=400)
     otp = request.json.get("otp")
 
-    guest = dal.get_guest_by_id(guest_id)
+    # single use, expiring, limited number of attempts:
+    check_result = otp_store.get_store().check(guest_id, otp)
+
+    guest = None
+    if check_result == otp_store.VALID:
+        guest = dal.get_guest_by_id(guest_id)
 
-    if dal.check_otp_dal(guest_id, otp):
+    if guest is not None:
         result = True
         session.clear()
         session['guest_id'] = guest.PK_Guest
@@ -89,6 +102,14 @@ def check_otp():
             identity={'phone_number': guest.PhoneNumber}, additional_claims={"is_guest": True})
         return jsonify(message="OTP checked and guest logged in",
                        status=200)
+    elif check_result == otp_store.EXPIRED:
+        return jsonify(result=result,
+                       message="OTP expired! Please request a new one.",
+                       status=401)
+    elif check_result == otp_store.TOO_MANY_ATTEMPTS:
+        return jsonify(result=result,
+                       message="Too many attempts! Please request a new OTP.",
+                       status=429)
     else:
         return jsonify(result=result,
                        message="Invalid OTP!",
@@ -1,7 +1,8 @@
 import json
 
 from flask import (
-    Blueprint, flash, request, session, jsonify, after_this_request
+    Blueprint, flash, request, session, jsonify, after_this_request,
+    Response, url_for
 )
 from werkzeug.security import check_password_hash, generate_password_hash
 from models import Queue
@@ -18,6 +19,8 @@ queues_bp = Blueprint('queues', __name__, url_prefix='/establishments')
 def get_queues(establishment_id, branch_id):
     """
     Does not expect any JSON object.
+    Accepts an optional '?fields=' query string parameter listing the fields
+    to return, e.g. '?fields=PK_Queue,Name,NumberOfPeopleEnqueuing'.
 
     Returns the following JSON Object if operation is successful:
     {
@@ -30,13 +33,23 @@ def get_queues(establishment_id, branch_id):
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response
 
-    queues_list = dal.get_queues(branch_id)
+    fields = helpers.get_requested_fields(request)
+    queues_list = dal.get_queues(
+        branch_id, with_qr_code=fields is None or 'QrCode' in fields)
+
+    if fields is None or 'NumberOfPeopleEnqueuing' in fields:
+        # get the number of people enqueuing in every queue at once:
+        counts = dal.get_people_enqueuing_counts(
+            [queue.PK_Queue for queue in queues_list])
+    else:
+        counts = None
+
     result = []
     # update number of people enqueeing info inside the queue:
     for queue in queues_list:
-        serialize_updated_queue = queue.serialize()
-        serialize_updated_queue['NumberOfPeopleEnqueuing'] = dal.get_people_enqueuing_count(
-            queue.PK_Queue)
+        serialize_updated_queue = queue.serialize(fields)
+        if counts is not None:
+            serialize_updated_queue['NumberOfPeopleEnqueuing'] = counts[queue.PK_Queue]
         result.append(serialize_updated_queue)
 
     if len(queues_list) > 0:
@@ -56,6 +69,8 @@ def get_queues(establishment_id, branch_id):
 def get_queue_by_id(establishment_id, branch_id, queue_id):
     """
     Does not expect any JSON object.
+    Accepts an optional '?fields=' query string parameter listing the fields
+    to return, e.g. '?fields=PK_Queue,Name,NumberOfPeopleEnqueuing'.
 
     Returns the following JSON Object if operation is successful:
     {
@@ -68,14 +83,17 @@ def get_queue_by_id(establishment_id, branch_id, queue_id):
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response
 
-    queue_with_id = dal.get_queue_by_id(queue_id)
-
-    # update number of people enqueeing info inside the queue:
-    serialize_updated_queue = queue_with_id.serialize()
-    serialize_updated_queue['NumberOfPeopleEnqueuing'] = dal.get_people_enqueuing_count(
-        queue_id)
+    fields = helpers.get_requested_fields(request)
+    queue_with_id = dal.get_queue_by_id(
+        queue_id, with_qr_code=fields is None or 'QrCode' in fields)
 
     if queue_with_id is not None:
+        serialize_updated_queue = queue_with_id.serialize(fields)
+        if fields is None or 'NumberOfPeopleEnqueuing' in fields:
+            # update number of people enqueeing info inside the queue:
+            serialize_updated_queue['NumberOfPeopleEnqueuing'] = dal.get_people_enqueuing_counts(
+                [queue_id])[queue_id]
+
         return jsonify(
             status=200,
             message=serialize_updated_queue
@@ -267,17 +285,23 @@ def delete_queue_by_id(establishment_id, branch_id, queue_id):
         )
 
 
-# Special endpoint:
+# Special endpoints:
 
 @queues_bp.route('/<int:establishment_id>/branches/<int:branch_id>/queues/<int:queue_id>/qr', methods=['POST'])
 def generate_qr_for_queue(establishment_id, branch_id, queue_id):
     """
     Does not expect any JSON object.
 
+    Generates the QR Code of the queue (if not already generated).
+    The QR Code is served as an image by 'GET .../queues/<queue_id>/qr.png'.
+
     Returns the following JSON Object if operation is successful:
     {
-        "status" : 200, 
-        "message" : "QR Code has been generated and added  successfully!"
+        "status" : 200,
+        "message" : {
+            "content" : "QR Code has been generated successfully!",
+            "qr_code_url" : "/establishments/.../qr.png"
+        }
     }
     """
     @after_this_request
@@ -287,21 +311,18 @@ def generate_qr_for_queue(establishment_id, branch_id, queue_id):
 
     found = dal.get_queue_by_id(queue_id)
     if found:
-        print("Received values: ", establishment_id, branch_id, queue_id)
-        # generate QR Code:
-        qr_code = qr.generate_qr_for_queue(
-            establishment_id, branch_id, queue_id)
-
-        # convert QR code to string:
-        qr_str = qr.qr_to_str(qr_code)
-
-        # add qr code string to db:
-        dal.add_qr_to_queue(queue_id, qr_str)
+        # generate QR Code (cached for the next requests):
+        qr.get_qr_png_for_queue(establishment_id, branch_id, queue_id)
 
         return jsonify(
             status=200,
-            message="QR Code for Queue with ID={} has been generated and stored successfully!".format(
-                queue_id)
+            message={
+                "content": "QR Code for Queue with ID={} has been generated successfully!".format(
+                    queue_id),
+                "qr_code_url": url_for(
+                    '.get_qr_png_for_queue', establishment_id=establishment_id,
+                    branch_id=branch_id, queue_id=queue_id)
+            }
         )
     else:
         return jsonify(
@@ -311,6 +332,39 @@ def generate_qr_for_queue(establishment_id, branch_id, queue_id):
         )
 
 
+@queues_bp.route('/<int:establishment_id>/branches/<int:branch_id>/queues/<int:queue_id>/qr.png', methods=['GET'])
+def get_qr_png_for_queue(establishment_id, branch_id, queue_id):
+    """
+    Does not expect any JSON object.
+
+    Returns the QR Code of the queue as a PNG image if the queue exists.
+    The QR Code never changes, so the image can be cached forever.
+    """
+    @after_this_request
+    def add_header(response):
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response
+
+    if dal.get_queue_by_id(queue_id) is None:
+        return jsonify(
+            status=404,
+            message="Queue with ID={} not found!".format(queue_id)
+        ), 404
+
+    # the client already has this image => no need to render/send it again
+    digest = qr.get_qr_digest_for_queue(establishment_id, branch_id, queue_id)
+    if request.if_none_match.contains(digest):
+        response = Response(status=304)
+    else:
+        png, digest = qr.get_qr_png_for_queue(
+            establishment_id, branch_id, queue_id)
+        response = Response(png, mimetype='image/png')
+
+    response.set_etag(digest)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
 # Removed get_qr_for_queue() since we can return the Queue object which contains the QR code inside of it.
 
 # @queues_bp.route('/<int:establishment_id>/branches/<int:branch_id>/queues/<int:queue_id>/qr', methods=['GET'])
@@ -1,9 +1,11 @@
 import json
-import bcrypt
-from models import Guest, Establishment, Branch, OTP
+import passwords  # bcrypt hashing (off the request's thread)
+from models import Guest, Establishment, Branch
 import dal  # import data access layer
 import helpers
-import sms
+import sms_outbox
+import otp_store
+import rate_limit
 import random
 
 from flask import (
@@ -16,6 +18,8 @@ registration_bp = Blueprint(
 
 
 @registration_bp.route('/guests', methods=['POST'])
+@rate_limit.limit(per_ip='10/hour', per_identity='3/hour',
+                  identity=rate_limit.json_field('phone_number'))
 def register_guest():
     """
     Expects the following JSON Object:
@@ -60,28 +64,30 @@ def register_guest():
 
     # add to database if everything is ok
     if error is None:
-        dal.add_guest(guest)
-
         # generate otp_code
         otp_code = random.randint(1000, 9999)
-        # create sms body
-        sms_body = 'Hello \'{}\'.\nYour verification code is:\'{}\''.format(
-            guest.Name, otp_code)
-        # send OTP code through sms
-        sms.send_sms(guest.PhoneNumber, sms_body)
 
-        # get guest ID after adding:
-        guest = dal.get_guest_by_phone_number(request.json.get('phone_number'))
+        # add the guest (single transaction):
+        guest_id = dal.register_guest(guest)
+        if guest_id is None:
+            error = 'Guest with phone number=\'{}\' is already registered.'.format(
+                request.json.get('phone_number'))
 
-        # post it on the db
-        otp = OTP(guest.PK_Guest, otp_code)
-        dal.add_otp(otp)
+    if error is None:
+        # store the OTP (it expires after otp_store.TTL seconds)
+        otp_store.get_store().put(guest_id, otp_code)
+
+        # create sms body
+        sms_body = 'Hello \'{}\'.\nYour verification code is:\'{}\''.format(
+            request.json.get('name'), otp_code)
+        # send OTP code through sms (in the background)
+        sms_outbox.send_sms_async(request.json.get('phone_number'), sms_body)
 
         return jsonify(
             status=200,
             message={
                 "content": "OTP sent, you will be redirected to enter the OTP",
-                "guest_id": guest.PK_Guest
+                "guest_id": guest_id
             }
         )
 
@@ -93,6 +99,7 @@ def register_guest():
 
 
 @registration_bp.route('/establishments', methods=['POST'])
+@rate_limit.limit(per_ip='10/hour')
 def register_establishment():
     """
     Expects the following JSON Object:
@@ -126,8 +133,7 @@ def register_establishment():
 
     if error is None:
         # Hash password using bcrypt
-        hashed = bcrypt.hashpw(request.json.get(
-            'password').encode('utf-8'), bcrypt.gensalt())
+        hashed = passwords.hash_password(request.json.get('password'))
 
         # map json object to class object
         establishment = Establishment(
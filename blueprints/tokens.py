@@ -3,8 +3,7 @@ import json
 from flask import (
     Blueprint, flash, request, session, jsonify, after_this_request
 )
-from mysocketio import socketio
-from flask_socketio import emit
+from mysocketio import emit_queue_event
 from werkzeug.security import check_password_hash, generate_password_hash
 from models import Token
 import dal  # import data access layer
@@ -12,6 +11,13 @@ import helpers
 
 tokens_bp = Blueprint('tokens', __name__, url_prefix='/establishments')
 
+# how long (in seconds) clients may cache 'GET .../tokens/info' responses
+INFO_MAX_AGE = 5
+
+# maximum number of guests enqueued by 'POST .../tokens/batch'
+# (SQL Server accepts at most 2100 parameters per statement)
+MAX_BATCH_SIZE = 1000
+
 
 # GET:
 
@@ -19,11 +25,15 @@ tokens_bp = Blueprint('tokens', __name__, url_prefix='/establishments')
 def get_tokens(establishment_id, branch_id, queue_id):
     """
     Does not expect any JSON object.
+    Accepts the optional '?limit=' and '?after=' query string parameters
+    (pass the 'next_cursor' of a page as 'after' to get the next page).
+    Without them, every item is returned (and next_cursor is null).
 
     Returns the following JSON Object if operation is successful:
     {
         "status" : 200,
-        "message" : tokens_list
+        "message" : tokens_list,
+        "next_cursor" : (int) /* null on the last page */
     }
     """
     @after_this_request
@@ -31,11 +41,15 @@ def get_tokens(establishment_id, branch_id, queue_id):
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response
 
-    tokens_list = dal.get_tokens(queue_id)
+    limit, after = helpers.get_page_args(request)
+    tokens_list, next_cursor = helpers.get_page(
+        dal.get_tokens(queue_id, helpers.get_fetch_limit(limit), after), limit,
+        lambda token: token.PK_Token)
     if len(tokens_list) > 0:
         return jsonify(
             status=200,
-            message=[token.serialize() for token in tokens_list]
+            message=[token.serialize() for token in tokens_list],
+            next_cursor=next_cursor
         )
     else:
         return jsonify(
@@ -95,7 +109,9 @@ def add_token(establishment_id, branch_id, queue_id):
         "status" : 200,
         "message" : {
             "content" : "Token Added to Database successfully!",
-            "queue_id" : (int)
+            "queue_id" : (int),
+            "token_id" : (int),
+            "pos_in_line" : (int)
         }
     }
     """
@@ -120,33 +136,102 @@ def add_token(establishment_id, branch_id, queue_id):
 
         # verify input info
         is_valid_tuple = token.is_valid()
-        if is_valid_tuple[0]:
-            # Verify that guest hasn't already enqueued:
-            tmp_token = dal.get_token(queue_id, token.FK_Guest)
-            if tmp_token is None or tmp_token.Status == -1:
-                # guest did not enqueue:
-
-                # Verify Referential Integrity
-                if dal.get_queue_by_id(queue_id) is None:
-                    error = 'Queue with Id={} does not exist. Impossible to add this token.'.format(
-                        queue_id)
-                if dal.get_guest_by_id(token.FK_Guest) is None:
-                    error = 'Guest with Id={} does not exist. Impossible to add this token.'.format(
-                        token.FK_Guest)
-            else:
-                error = 'Guest with Id={} is already enqueued. Impossible to add this token.'.format(
-                    token.FK_Guest)
-        else:
+        if not is_valid_tuple[0]:
             error = is_valid_tuple[1]
 
     # add to database if everything is ok
+    # (a single conditional insert verifies referential integrity and that
+    # the guest hasn't already enqueued, even under concurrent requests)
+    if error is None:
+        result, token_id = dal.enqueue_guest(queue_id, token.FK_Guest)
+        if result == dal.QUEUE_NOT_FOUND:
+            error = 'Queue with Id={} does not exist. Impossible to add this token.'.format(
+                queue_id)
+        elif result == dal.GUEST_NOT_FOUND:
+            error = 'Guest with Id={} does not exist. Impossible to add this token.'.format(
+                token.FK_Guest)
+        elif result == dal.GUEST_ALREADY_ENQUEUED:
+            error = 'Guest with Id={} is already enqueued. Impossible to add this token.'.format(
+                token.FK_Guest)
+
     if error is None:
-        dal.add_token(token)
         return jsonify(
             status=200,
             message={
                 "content": "Token Added to Database successfully!",
-                "queue_id": queue_id
+                "queue_id": queue_id,
+                "token_id": token_id,
+                "pos_in_line": dal.get_position_in_line(queue_id, token.FK_Guest)
+            }
+        )
+    else:
+        return jsonify(
+            status=400,
+            message=error
+        )
+
+
+@tokens_bp.route('/<int:establishment_id>/branches/<int:branch_id>/queues/<int:queue_id>/tokens/batch', methods=['POST'])
+def add_tokens(establishment_id, branch_id, queue_id):
+    """
+    Enqueues several guests at once (e.g., groups, kiosk imports).
+
+    Expects the following JSON Object:
+    {
+        "guest_ids": [int, int, ...] (at most MAX_BATCH_SIZE Ids)
+    }
+
+    Returns the following JSON Object if operation is successful:
+    {
+        "status" : 200,
+        "message" : {
+            "queue_id" : (int),
+            "added_count" : (int),
+            "results" : [
+                {
+                    "guest_id" : (int),
+                    "status" : 200 | 400,
+                    "message" : (str)
+                },
+                ...
+            ]
+        }
+    }
+    """
+    @after_this_request
+    def add_header(response):
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response
+
+    # initially, assume that there is no error
+    error = None
+
+    # verify expected JSON:
+    if not helpers.request_is_valid(request, keys_list=["guest_ids"]):
+        error = "Invalid JSON Object."
+    else:
+        guest_ids = request.json.get('guest_ids')
+        if not isinstance(guest_ids, list) or len(guest_ids) == 0 \
+                or not all(type(guest_id) is int for guest_id in guest_ids):
+            error = "'guest_ids' must be a non-empty list of integers."
+        elif len(guest_ids) > MAX_BATCH_SIZE:
+            error = "Impossible to enqueue more than {} guests at once.".format(
+                MAX_BATCH_SIZE)
+        elif dal.get_queue_by_id(queue_id) is None:
+            error = 'Queue with Id={} does not exist. Impossible to add these tokens.'.format(
+                queue_id)
+
+    # add to database if everything is ok
+    if error is None:
+        results = dal.add_tokens(queue_id, guest_ids)
+        return jsonify(
+            status=200,
+            message={
+                "queue_id": queue_id,
+                "added_count": sum(1 for result in results.values()
+                                   if result == dal.TOKEN_ADDED),
+                "results": [get_batch_result(guest_id, result)
+                            for guest_id, result in results.items()]
             }
         )
     else:
@@ -156,6 +241,27 @@ def add_token(establishment_id, branch_id, queue_id):
         )
 
 
+def get_batch_result(guest_id, result):
+    """
+    Returns the JSON Object describing the result of enqueuing a given guest.
+    """
+    if result == dal.TOKEN_ADDED:
+        status, message = 200, "Token Added to Database successfully!"
+    elif result == dal.GUEST_NOT_FOUND:
+        status, message = 400, 'Guest with Id={} does not exist. Impossible to add this token.'.format(
+            guest_id)
+    elif result == dal.QUEUE_NOT_FOUND:
+        status, message = 400, 'Queue does not exist. Impossible to add this token.'
+    else:
+        status, message = 400, 'Guest with Id={} is already enqueued. Impossible to add this token.'.format(
+            guest_id)
+    return {
+        "guest_id": guest_id,
+        "status": status,
+        "message": message
+    }
+
+
 # PUT
 
 @tokens_bp.route('/<int:establishment_id>/branches/<int:branch_id>/queues/<int:queue_id>/tokens/<int:token_id>', methods=['PUT'])
@@ -283,6 +389,7 @@ def delete_token_by_id(establishment_id, branch_id, queue_id, token_id):
 # Special Endpoints (POST):
 
 # BAD DESIGN HERE (I am aware of it) - POST Method but it just gets you information
+# => Kept for existing clients. The GET variant below can be cached.
 
 @tokens_bp.route('/<int:establishment_id>/branches/<int:branch_id>/queues/<int:queue_id>/tokens/info', methods=['POST'])
 def get_info(establishment_id, branch_id, queue_id):
@@ -307,49 +414,19 @@ def get_info(establishment_id, branch_id, queue_id):
     # verify expected JSON:
     if not helpers.request_is_valid(request, keys_list=["guest_id"]):
         error = "Invalid JSON Object."
+    else:
+        try:
+            # (the guest Id may be sent as a number or as a string)
+            guest_id = int(request.json.get('guest_id'))
+        except (TypeError, ValueError):
+            error = "Invalid JSON Object."
 
     if error is None:
-        # verify that guest and queue actually exist:
-        guest_with_id = dal.get_guest_by_id(request.json.get('guest_id'))
-        queue_with_id = dal.get_queue_by_id(queue_id)
-
-        if guest_with_id is not None and queue_with_id is not None:
-            # get position in line:
-            pos_in_line = dal.get_position_in_line(
-                queue_id, request.json.get('guest_id'))
-            # get approximate time of service:
-            approximate_time_of_service = dal.get_queue_by_id(
-                queue_id).ApproximateTimeOfService
-
-            # compute time remaining using the following formula:
-            time_remaining = pos_in_line * approximate_time_of_service
-
-            # get number of people enqueuing:
-            number_of_people_enqueuing = dal.get_people_enqueuing_count(
-                queue_id)
-
-            serializedResponse = {
-                "pos_in_line": pos_in_line,
-                "time_remaining": time_remaining,
-                "number_of_people_enqueuing": number_of_people_enqueuing
-            }
-
-            if pos_in_line != -1:
-                return jsonify(
-                    status=200,
-                    message=serializedResponse
-                )
-            else:
-                return jsonify(
-                    status=400,
-                    message="Something went wrong. The IDs you have passed may be invalid."
-                )
-        else:
-            return jsonify(
-                status=404,
-                message="Guest with Id={} OR Queue with Id={} not found!".format(
-                    request.json.get('guest_id'), queue_id)
-            )
+        status, message = get_info_message(queue_id, guest_id)
+        return jsonify(
+            status=status,
+            message=message
+        )
     else:
         return jsonify(
             status=404,
@@ -357,6 +434,72 @@ def get_info(establishment_id, branch_id, queue_id):
         )
 
 
+@tokens_bp.route('/<int:establishment_id>/branches/<int:branch_id>/queues/<int:queue_id>/tokens/info', methods=['GET'])
+def get_info_cacheable(establishment_id, branch_id, queue_id):
+    """
+    Expects the following query string:
+    ?guest_id=(int)
+
+    Returns the same JSON Object as 'POST .../tokens/info'.
+    Successful responses carry an ETag and may be cached by the client
+    for INFO_MAX_AGE seconds.
+    """
+    @after_this_request
+    def add_header(response):
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        return response
+
+    guest_id = request.args.get('guest_id', type=int)
+    if guest_id is None:
+        return jsonify(
+            status=404,
+            message="Invalid Query String."
+        )
+
+    status, message = get_info_message(queue_id, guest_id)
+    response = jsonify(
+        status=status,
+        message=message
+    )
+    if status == 200:
+        response.cache_control.private = True
+        response.cache_control.max_age = INFO_MAX_AGE
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+
+def get_info_message(queue_id, guest_id):
+    """
+    Returns a Tuple(status, message) holding the info of a guest in a queue.
+    """
+    # verify that guest and queue actually exist, and get the info
+    # (single round trip):
+    info = dal.get_queue_info(queue_id, guest_id)
+
+    if info is not None:
+        pos_in_line = info['pos_in_line']
+
+        # compute time remaining using the following formula (the service
+        # time is estimated from the observed service times, and defaults
+        # to the queue's ApproximateTimeOfService):
+        time_remaining = pos_in_line * info['service_time']
+
+        serializedResponse = {
+            "pos_in_line": pos_in_line,
+            "time_remaining": time_remaining,
+            "number_of_people_enqueuing": info['number_of_people_enqueuing']
+        }
+
+        if pos_in_line != -1:
+            return (200, serializedResponse)
+        else:
+            return (400, "Something went wrong. The IDs you have passed may be invalid.")
+    else:
+        return (404, "Guest with Id={} OR Queue with Id={} not found!".format(
+            guest_id, queue_id))
+
+
 # commented this out and made it one function
 
 # @tokens_bp.route('/<int:establishment_id>/branches/<int:branch_id>/queues/<int:queue_id>/tokens/<int:token_id>/time_remaining', methods=['GET'])
@@ -503,6 +646,9 @@ def serve_guest(establishment_id, branch_id, queue_id):
         "status": 200,
         "message": "Guest Served!"
     }
+
+    Emits a 'serve' event to the queue's and branch's rooms.
+    The position of every guest still waiting decreases by 1.
     """
     guest_id = dal.serve_guest(queue_id)
     if guest_id != -1:
@@ -512,10 +658,12 @@ def serve_guest(establishment_id, branch_id, queue_id):
             "message": {
                 "content": 'A Guest within a Queue has been Served.',
                 "queue_id": queue_id,
-                "guest_id": guest_id
+                "guest_id": guest_id,
+                "head_of_line": dal.get_head_of_line(queue_id),
+                "number_of_people_enqueuing": dal.get_people_enqueuing_count(queue_id)
             }
         }
-        socketio.emit("serve", jsonObj, broadcast=True)
+        emit_queue_event("serve", jsonObj, branch_id, queue_id)
 
         # send sms to the concerned guest:
         serving_queue = dal.get_queue_by_id(queue_id)
@@ -545,6 +693,8 @@ def dequeue_guest(establishment_id, branch_id, queue_id):
         "status": 200,
         "message": "Guest Dequeued!"
     }
+
+    Emits a 'dequeue' event to the queue's and branch's rooms.
     """
     guest_id = dal.dequeue_guest(queue_id)
     if guest_id != -1:
@@ -552,12 +702,14 @@ def dequeue_guest(establishment_id, branch_id, queue_id):
         jsonObj = {
             "status": 200,
             "message": {
-                "content": 'A Guest within a Queue has been Dequeued. Therefore, all guests within that queue must pull their updated Position In Line again.',
+                "content": 'A Guest within a Queue has been Dequeued. The positions of the guests still waiting are unchanged.',
                 "queue_id": queue_id,
-                "guest_id": guest_id
+                "guest_id": guest_id,
+                "head_of_line": dal.get_head_of_line(queue_id),
+                "number_of_people_enqueuing": dal.get_people_enqueuing_count(queue_id)
             }
         }
-        socketio.emit("dequeue", jsonObj, broadcast=True)
+        emit_queue_event("dequeue", jsonObj, branch_id, queue_id)
 
         # return JSON object:
         return jsonify(
@@ -581,6 +733,8 @@ def close_queue(establishment_id, branch_id, queue_id):
         "status": 200,
         "message": "Queue Closed!"
     }
+
+    Emits a 'close' event to the queue's and branch's rooms.
     """
     success = dal.close_queue(queue_id)
     if success:
@@ -589,10 +743,12 @@ def close_queue(establishment_id, branch_id, queue_id):
             "status": 200,
             "message": {
                 "content": 'A Queue has been closed. Therefore, all guests within that queue must leave the queue.',
-                "queue_id": queue_id
+                "queue_id": queue_id,
+                "head_of_line": None,
+                "number_of_people_enqueuing": 0
             }
         }
-        socketio.emit("close", jsonObj, broadcast=True)
+        emit_queue_event("close", jsonObj, branch_id, queue_id)
 
         return jsonify(
             status=200,
@@ -0,0 +1,224 @@
+# In-process spatial index of the branches (nearest branch search).
+#
+# Branches are bucketed in a grid of CELL_SIZE x CELL_SIZE degrees cells
+# (like geohash cells). A search within a radius only looks at the cells
+# overlapping the bounding box of the search circle, then filters and sorts
+# the candidates by their haversine distance.
+#
+# The index is loaded from the database on the first search (one query), then
+# kept in sync by the DAL functions that add, update or delete branches. Like
+# the queue index, it assumes that every write goes through this process.
+#
+# Every mutation bumps the generation of the index: a load that overlapped a
+# mutation (and may have missed it) is not published, but loaded again.
+
+import heapq
+import math
+import os
+import threading
+
+from models import Branch
+
+# import database:
+from database import db
+
+
+# Configuration (can be overridden with environment variables):
+CELL_SIZE = float(os.environ.get('BRANCH_INDEX_CELL_SIZE', 0.05))  # degrees (~5.5 km)
+
+# number of attempts to load (and publish) the index while branches are written
+MAX_LOAD_ATTEMPTS = 3
+
+EARTH_RADIUS = 6371.0088  # km
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+# (cell_x, cell_y) -> {branch_id: (latitude, phi, lambda, cos(phi), summary)}
+# (phi and lambda are the latitude and longitude in radians)
+_cells = {}
+# branch_id -> (cell_x, cell_y)
+_branch_cells = {}
+_loaded = False
+# number of mutations/invalidations of the index
+_generation = 0
+_lock = threading.RLock()
+
+_LONGITUDE_CELLS = int(math.ceil(360 / CELL_SIZE))
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """
+    Returns the distance (in km) between two GPS locations.
+    """
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(longitude2 - longitude1)
+    a = math.sin(d_phi / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cell_of(latitude, longitude):
+    return (int(math.floor((longitude + 180) / CELL_SIZE)) % _LONGITUDE_CELLS,
+            int(math.floor((latitude + 90) / CELL_SIZE)))
+
+
+# public fields of a branch returned by the searches:
+SUMMARY_COLUMNS = [Branch.PK_Branch, Branch.FK_Establishment, Branch.Address,
+                   Branch.PhoneNumber, Branch.Latitude, Branch.Longitude]
+
+
+def summarize(branch):
+    """
+    Returns the public fields of a branch (or of a row of SUMMARY_COLUMNS).
+    """
+    return {
+        'PK_Branch': branch.PK_Branch,
+        'FK_Establishment': branch.FK_Establishment,
+        'Address': branch.Address,
+        'PhoneNumber': branch.PhoneNumber,
+        'Latitude': branch.Latitude,
+        'Longitude': branch.Longitude
+    }
+
+
+def _put(cells, branch_cells, summary):
+    latitude, longitude = summary['Latitude'], summary['Longitude']
+    if latitude is None or longitude is None:
+        return
+    cell = _cell_of(latitude, longitude)
+    phi = math.radians(latitude)
+    cells.setdefault(cell, {})[summary['PK_Branch']] = (
+        latitude, phi, math.radians(longitude), math.cos(phi), summary)
+    branch_cells[summary['PK_Branch']] = cell
+
+
+def _add(summary):
+    _remove(summary['PK_Branch'])
+    _put(_cells, _branch_cells, summary)
+
+
+def _remove(branch_id):
+    cell = _branch_cells.pop(branch_id, None)
+    if cell is not None:
+        entries = _cells[cell]
+        del entries[branch_id]
+        if len(entries) == 0:
+            del _cells[cell]
+
+
+def _load():
+    """
+    Loads every located branch from the database, if not loaded yet.
+    Returns the cells to search.
+    """
+    global _cells, _branch_cells, _loaded
+    for _ in range(MAX_LOAD_ATTEMPTS):
+        with _lock:
+            if _loaded:
+                return _cells
+            generation = _generation
+
+        rows = db.session.query(*SUMMARY_COLUMNS).filter(
+            Branch.Latitude.isnot(None), Branch.Longitude.isnot(None)).all()
+        cells, branch_cells = {}, {}
+        for row in rows:
+            _put(cells, branch_cells, summarize(row))
+
+        with _lock:
+            if _loaded:
+                # (loaded by another request in the meantime)
+                return _cells
+            if _generation == generation:
+                _cells, _branch_cells, _loaded = cells, branch_cells, True
+                return cells
+            # else a branch was written during the load: load it again
+
+    # (still being written: search the last load, without publishing it)
+    return cells
+
+
+def invalidate():
+    """
+    Drops the index. It will be reloaded from the database on the next search.
+    """
+    global _loaded, _generation
+    with _lock:
+        _generation += 1
+        _cells.clear()
+        _branch_cells.clear()
+        _loaded = False
+
+
+# Search:
+
+
+def get_nearby_branches(latitude, longitude, radius, limit=None):
+    """
+    Returns the list of Tuple(distance in km, branch summary) of the branches
+    within 'radius' km of a GPS location, sorted by distance.
+    """
+    cells = _load()
+
+    # bounding box of the search circle (in degrees):
+    d_latitude = radius / KM_PER_DEGREE
+    cos_latitude = math.cos(math.radians(min(89.9, abs(latitude) + d_latitude)))
+    d_longitude = min(180.0, radius / (KM_PER_DEGREE * cos_latitude))
+
+    min_x = int(math.floor((longitude - d_longitude + 180) / CELL_SIZE))
+    max_x = int(math.floor((longitude + d_longitude + 180) / CELL_SIZE))
+    min_y = int(math.floor((max(-90.0, latitude - d_latitude) + 90) / CELL_SIZE))
+    max_y = int(math.floor((min(90.0, latitude + d_latitude) + 90) / CELL_SIZE))
+    columns = {x % _LONGITUDE_CELLS for x in range(min_x, max_x + 1)}
+
+    # a branch is within the radius iff the haversine of its central angle
+    # ('a' in haversine()) is at most:
+    max_a = math.sin(min(math.pi, radius / EARTH_RADIUS) / 2) ** 2
+    phi, lambda_ = math.radians(latitude), math.radians(longitude)
+    cos_phi = math.cos(phi)
+
+    candidates = []
+    with _lock:
+        if len(columns) * (max_y - min_y + 1) <= len(cells):
+            candidate_cells = [cells.get((x, y)) for x in columns
+                               for y in range(min_y, max_y + 1)]
+        else:
+            # (huge radius: cheaper to go through the non-empty cells)
+            candidate_cells = [entries for (x, y), entries in cells.items()
+                               if x in columns and min_y <= y <= max_y]
+
+        for entries in candidate_cells:
+            if entries is None:
+                continue
+            for branch_latitude, branch_phi, branch_lambda, branch_cos_phi, summary in entries.values():
+                if abs(branch_latitude - latitude) > d_latitude:
+                    continue
+                a = math.sin((branch_phi - phi) / 2) ** 2 + \
+                    cos_phi * branch_cos_phi * math.sin((branch_lambda - lambda_) / 2) ** 2
+                if a <= max_a:
+                    candidates.append((a, summary['PK_Branch'], summary))
+
+    # ('a' increases with the distance: sort by 'a', then compute the distances)
+    if limit is not None:
+        candidates = heapq.nsmallest(limit, candidates, key=lambda c: (c[0], c[1]))
+    else:
+        candidates.sort(key=lambda c: (c[0], c[1]))
+    return [(2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a))), summary)
+            for a, branch_id, summary in candidates]
+
+
+# Mutations (called by the DAL once the database has been updated):
+
+
+def add_branch(summary):
+    global _generation
+    with _lock:
+        _generation += 1
+        if _loaded:
+            _add(summary)
+
+
+def remove_branch(branch_id):
+    global _generation
+    with _lock:
+        _generation += 1
+        _remove(branch_id)
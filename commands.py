@@ -0,0 +1,47 @@
+# Command line interface ('flask <command>', with FLASK_APP=api.py).
+
+import click
+from flask.cli import AppGroup, with_appcontext
+
+import exports  # import NDJSON exports
+import token_archive  # import archival of the finished tokens
+
+
+export_cli = AppGroup('export', help='Export records as NDJSON.')
+
+
+def _export_command(name):
+    @click.option('--queue-id', type=int, default=None)
+    @click.option('--branch-id', type=int, default=None)
+    @click.option('--since', default=None, help='ISO 8601 date (inclusive).')
+    @click.option('--until', default=None, help='ISO 8601 date (exclusive).')
+    @click.option('--output', '-o', type=click.File('w'), default='-',
+                  help='Output file (stdout by default).')
+    def command(queue_id, branch_id, since, until, output):
+        try:
+            since = exports.parse_date(since)
+            until = exports.parse_date(until)
+        except ValueError:
+            raise click.BadParameter(
+                'dates must be in the ISO 8601 format, e.g. 2021-05-01')
+
+        for line in exports.generate_ndjson(name, queue_id, branch_id, since, until):
+            output.write(line)
+
+    command.__doc__ = 'Export the {} as NDJSON.'.format(name)
+    export_cli.command(name)(command)
+
+
+for export_name in exports.EXPORTS:
+    _export_command(export_name)
+
+
+@click.command('archive-tokens')
+@click.option('--older-than', type=float, default=token_archive.ARCHIVE_AFTER,
+              help='Age (in seconds) of the finished tokens to archive.')
+@click.option('--batch-size', type=int, default=token_archive.BATCH_SIZE)
+@with_appcontext
+def archive_tokens_command(older_than, batch_size):
+    """Move the finished tokens to the history table."""
+    archived_count = token_archive.archive_tokens(older_than, batch_size)
+    click.echo('{} token(s) archived.'.format(archived_count))
@@ -1,30 +1,84 @@
 # Data Access Layer (Script)
 
+import datetime
 
-from models import Guest, Establishment, Branch, Queue, Token, CovidInfection, OTP
+
+from models import Guest, Establishment, Branch, Queue, Token, TokenHistory, CovidInfection
 
 # import database:
 from database import db
 
-# importing func for function calls
-from sqlalchemy import func
+# import in-process queue index
+import queue_index
+
+# import stored procedures execution layer
+import procedures
+
+# import adaptive service time estimation
+import wait_time
+
+# import metrics
+import metrics
+
+# import in-process spatial index of the branches
+import branch_index
+
+# import read-through cache of the entities looked up by Id
+import entity_cache
+
+# importing sqlalchemy expressions for the bulk and conditional statements
+from sqlalchemy import and_, literal, select, exists
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import undefer
+
+# import app config
+from flask import current_app
+
+
+# Pagination:
+
+
+def paginate(query, key_column, limit=None, after=None):
+    """
+    Returns the rows of 'query' ordered by 'key_column' (keyset pagination):
+    at most 'limit' rows (all rows if None) whose key is greater than
+    'after' (from the first row if None).
+    """
+    if after is not None:
+        query = query.filter(key_column > after)
+    query = query.order_by(key_column)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
 
 
 # Guests related functions:
 
 
-def get_guests():
+def get_guests(limit=None, after=None):
     """
-    Returns the list of guests
+    Returns the list of guests (see paginate() for 'limit' and 'after')
     """
-    return Guest.query.all()
+    return paginate(Guest.query, Guest.PK_Guest, limit, after)
+
+
+def detached(entity):
+    """
+    Detaches an entity from the session so it can be cached.
+    Returns the entity.
+    """
+    if entity is not None:
+        db.session.expunge(entity)
+    return entity
 
 
 def get_guest_by_id(id):
     """
     Returns the target guest if found. Returns None otherwise.
+    (Cached: the returned guest must not be modified.)
     """
-    return Guest.query.filter_by(PK_Guest=id).first()
+    return entity_cache.guests.get_or_load(
+        id, lambda: detached(Guest.query.filter_by(PK_Guest=id).first()))
 
 
 def get_guest_by_name(name):
@@ -49,6 +103,28 @@ def add_guest(guest):
     db.session.commit()
 
 
+def register_guest(guest):
+    """
+    Adds a guest in a single transaction (the guest's Id is obtained by
+    flushing, without querying it back).
+
+    Returns the new guest's Id, or None if the phone number is already
+    registered (e.g., by a concurrent registration).
+    """
+    try:
+        db.session.add(guest)
+        db.session.flush()
+        guest_id = guest.PK_Guest
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return None
+    except:
+        db.session.rollback()
+        raise
+    return guest_id
+
+
 def update_guest_by_id(id, guest):
     """
     Returns True if update succeeds; returns False otherwise.
@@ -57,6 +133,7 @@ def update_guest_by_id(id, guest):
     if target_guest is not None:
         target_guest.update(guest)
         db.session.commit()
+        entity_cache.guests.invalidate(id)
         return True
     else:
         return False
@@ -68,6 +145,7 @@ def delete_guests():
     """
     Guest.query.delete()
     db.session.commit()
+    entity_cache.guests.invalidate()
 
 
 def delete_guest_by_id(id):
@@ -78,6 +156,7 @@ def delete_guest_by_id(id):
     if target_guest is not None:
         target_guest.delete()
         db.session.commit()
+        entity_cache.guests.invalidate(id)
         return True
     else:
         return False
@@ -86,18 +165,20 @@ def delete_guest_by_id(id):
 # Establishments related functions:
 
 
-def get_establishments():
+def get_establishments(limit=None, after=None):
     """
-    Returns the list of establishments
+    Returns the list of establishments (see paginate() for 'limit' and 'after')
     """
-    return Establishment.query.all()
+    return paginate(Establishment.query, Establishment.PK_Establishment, limit, after)
 
 
 def get_establishment_by_id(id):
     """
     Returns the target establishment if found. Returns None otherwise.
+    (Cached: the returned establishment must not be modified.)
     """
-    return Establishment.query.filter_by(PK_Establishment=id).first()
+    return entity_cache.establishments.get_or_load(
+        id, lambda: detached(Establishment.query.filter_by(PK_Establishment=id).first()))
 
 
 def get_establishment_by_name(name):
@@ -145,17 +226,31 @@ def update_establishment_by_id(id, establishment):
     if target_establishment is not None:
         target_establishment.update(establishment)
         db.session.commit()
+        entity_cache.establishments.invalidate(id)
         return True
     else:
         return False
 
 
+def update_establishment_password(id, hashed_password):
+    """
+    Replaces the (hashed) password of an establishment.
+    Returns True if update succeeds; returns False otherwise.
+    """
+    updated_count = Establishment.query.filter_by(PK_Establishment=id).update(
+        {Establishment.Password: hashed_password}, synchronize_session=False)
+    db.session.commit()
+    entity_cache.establishments.invalidate(id)
+    return updated_count > 0
+
+
 def delete_establishments():
     """
     Does not return anything.
     """
     Establishment.query.delete()
     db.session.commit()
+    entity_cache.establishments.invalidate()
 
 
 def delete_establishment_by_id(id):
@@ -167,6 +262,7 @@ def delete_establishment_by_id(id):
     if target_establishment is not None:
         target_establishment.delete()
         db.session.commit()
+        entity_cache.establishments.invalidate(id)
         return True
     else:
         return False
@@ -175,18 +271,21 @@ def delete_establishment_by_id(id):
 # Branches related functions:
 
 
-def get_branches(establishment_id):
+def get_branches(establishment_id, limit=None, after=None):
     """
-    Returns the list of branches
+    Returns the list of branches (see paginate() for 'limit' and 'after')
     """
-    return Branch.query.filter_by(FK_Establishment=establishment_id).all()
+    return paginate(Branch.query.filter_by(FK_Establishment=establishment_id),
+                    Branch.PK_Branch, limit, after)
 
 
 def get_branch_by_id(branch_id):
     """
     Returns the target branch if found. Returns None otherwise.
+    (Cached: the returned branch must not be modified.)
     """
-    return Branch.query.filter_by(PK_Branch=branch_id).first()
+    return entity_cache.branches.get_or_load(
+        branch_id, lambda: detached(Branch.query.filter_by(PK_Branch=branch_id).first()))
 
 
 def get_branch_by_name(establishment_id, name):
@@ -224,13 +323,26 @@ def get_branch_by_gps_location(establishment_id, latitude, longitude):
     return Branch.query.filter_by(FK_Establishment=establishment_id, Latitude=latitude, Longitude=longitude).first()
 
 
+def get_nearby_branches(latitude, longitude, radius, limit=None):
+    """
+    Returns the list of Tuple(distance in km, branch summary) of the branches
+    within 'radius' km of a GPS location, sorted by distance.
+    """
+    return branch_index.get_nearby_branches(latitude, longitude, radius, limit)
+
+
 def add_branch(branch):
     """
     Does not return anything
     """
     db.session.add(branch)
+    # flush first to get the branch's fields before they expire on commit
+    db.session.flush()
+    summary = branch_index.summarize(branch)
     db.session.commit()
 
+    branch_index.add_branch(summary)
+
 
 def update_branch_by_id(establishment_id, branch_id, branch):
     """
@@ -241,12 +353,27 @@ def update_branch_by_id(establishment_id, branch_id, branch):
 
     if target_branch is not None:
         target_branch.update(branch)
+        summary = branch_index.summarize(target_branch)
         db.session.commit()
+        entity_cache.branches.invalidate(branch_id)
+        branch_index.add_branch(summary)
         return True
     else:
         return False
 
 
+def update_branch_password(branch_id, hashed_password):
+    """
+    Replaces the (hashed) password of a branch.
+    Returns True if update succeeds; returns False otherwise.
+    """
+    updated_count = Branch.query.filter_by(PK_Branch=branch_id).update(
+        {Branch.Password: hashed_password}, synchronize_session=False)
+    db.session.commit()
+    entity_cache.branches.invalidate(branch_id)
+    return updated_count > 0
+
+
 def delete_branches(establishment_id):
     """
     Returns True if deletion succeeds; returns False otherwise.
@@ -257,6 +384,8 @@ def delete_branches(establishment_id):
     if target_branches is not None:
         target_branches.delete()
         db.session.commit()
+        entity_cache.branches.invalidate()
+        branch_index.invalidate()
         return True
     else:
         return False
@@ -272,6 +401,8 @@ def delete_branch_by_id(establishment_id, branch_id):
     if target_branch is not None:
         target_branch.delete()
         db.session.commit()
+        entity_cache.branches.invalidate(branch_id)
+        branch_index.remove_branch(branch_id)
         return True
     else:
         return False
@@ -280,18 +411,28 @@ def delete_branch_by_id(establishment_id, branch_id):
 # Queues related functions:
 
 
-def get_queues(branch_id):
+def get_queues(branch_id, with_qr_code=False):
     """
-    Returns the list of queues
+    Returns the list of queues.
+    The (heavy) QrCode column is only loaded if 'with_qr_code' is True.
     """
-    return Queue.query.filter_by(FK_Branch=branch_id).all()
+    query = Queue.query.filter_by(FK_Branch=branch_id)
+    if with_qr_code:
+        query = query.options(undefer(Queue.QrCode))
+    return query.all()
 
 
-def get_queue_by_id(queue_id):
+def get_queue_by_id(queue_id, with_qr_code=False):
     """
     Returns the target queue if found. Returns None otherwise.
+    The (heavy) QrCode column is only loaded if 'with_qr_code' is True.
+    (Cached without QrCode: the returned queue must not be modified.)
     """
-    return Queue.query.filter_by(PK_Queue=queue_id).first()
+    query = Queue.query.filter_by(PK_Queue=queue_id)
+    if with_qr_code:
+        return query.options(undefer(Queue.QrCode)).first()
+    return entity_cache.queues.get_or_load(
+        queue_id, lambda: detached(query.first()))
 
 
 def get_queue_by_name(branch_id, name):
@@ -318,6 +459,7 @@ def update_queue_by_id(queue_id, queue):
     if target_queue is not None:
         target_queue.update(queue)
         db.session.commit()
+        entity_cache.queues.invalidate(queue_id)
         return True
     else:
         return False
@@ -332,6 +474,7 @@ def delete_queues(branch_id):
     if target_queues is not None:
         target_queues.delete()
         db.session.commit()
+        entity_cache.queues.invalidate()
         return True
     else:
         return False
@@ -346,6 +489,7 @@ def delete_queue_by_id(queue_id):
     if target_queue is not None:
         target_queue.delete()
         db.session.commit()
+        entity_cache.queues.invalidate(queue_id)
         return True
     else:
         return False
@@ -375,11 +519,12 @@ def get_qr_by_queue_id(queue_id):
 # Tokens related functions:
 
 
-def get_tokens(queue_id):
+def get_tokens(queue_id, limit=None, after=None):
     """
-    Returns the list of tokens
+    Returns the list of tokens (see paginate() for 'limit' and 'after')
     """
-    return Token.query.filter_by(FK_Queue=queue_id).all()
+    return paginate(Token.query.filter_by(FK_Queue=queue_id),
+                    Token.PK_Token, limit, after)
 
 
 def get_token_by_id(token_id):
@@ -408,8 +553,136 @@ def add_token(token):
     Does not return anything
     """
     db.session.add(token)
+    # flush first to get the token's key before it expires on commit
+    db.session.flush()
+    key = (token.FK_Queue, token.FK_Guest, token.PK_Token, token.DateAndTime)
     db.session.commit()
 
+    queue_index.add_token(*key)
+
+
+# Results of enqueue_guest and add_tokens (per guest):
+TOKEN_ADDED = 'added'
+GUEST_NOT_FOUND = 'guest_not_found'
+QUEUE_NOT_FOUND = 'queue_not_found'
+GUEST_ALREADY_ENQUEUED = 'guest_already_enqueued'
+
+
+def enqueue_guest(queue_id, guest_id):
+    """
+    Enqueues a guest in a given Queue with a single conditional INSERT, which
+    only inserts the token if the guest and the queue exist and the guest is
+    not already enqueued. Concurrent enqueues of the same guest are rejected
+    by the unique index on the active tokens.
+
+    Returns a Tuple(result, token_id): result is TOKEN_ADDED (with the new
+    token's Id), GUEST_NOT_FOUND, QUEUE_NOT_FOUND or GUEST_ALREADY_ENQUEUED
+    (with token_id None).
+    """
+    now = datetime.datetime.utcnow()
+    guest_exists = exists().where(Guest.PK_Guest == guest_id)
+    queue_exists = exists().where(Queue.PK_Queue == queue_id)
+    already_enqueued = exists().where(and_(
+        Token.FK_Queue == queue_id, Token.FK_Guest == guest_id, Token.Status != -1))
+
+    statement = Token.__table__.insert().from_select(
+        ['FK_Guest', 'FK_Queue', 'Status', 'DateAndTime'],
+        select([literal(guest_id), literal(queue_id), literal(0),
+                literal(now, type_=db.DateTime)]).where(
+            and_(guest_exists, queue_exists, ~already_enqueued)))
+
+    token_id = None
+    try:
+        if db.engine.dialect.implicit_returning:
+            # SQL Server (OUTPUT inserted.PK_Token), Postgres (RETURNING)
+            row = db.session.execute(statement.returning(Token.PK_Token)).first()
+            if row is not None:
+                token_id = row[0]
+        else:
+            result = db.session.execute(statement)
+            if result.rowcount == 1:
+                token_id = result.lastrowid
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request has just enqueued the same guest
+        db.session.rollback()
+        return (GUEST_ALREADY_ENQUEUED, None)
+    except:
+        db.session.rollback()
+        raise
+
+    if token_id is not None:
+        queue_index.add_token(queue_id, guest_id, token_id, now)
+        return (TOKEN_ADDED, token_id)
+
+    # nothing inserted: find out why (failure path only)
+    reasons = db.session.query(guest_exists, queue_exists, already_enqueued).first()
+    if not reasons[1]:
+        return (QUEUE_NOT_FOUND, None)
+    if not reasons[0]:
+        return (GUEST_NOT_FOUND, None)
+    return (GUEST_ALREADY_ENQUEUED, None)
+
+
+def add_tokens(queue_id, guest_ids):
+    """
+    Enqueues several guests in a given Queue, in a single transaction:
+    - the guests are validated with a single query,
+    - the tokens are inserted with a single (executemany) statement.
+    If a concurrent request enqueues one of the guests in the meantime (the
+    unique index on the active tokens rejects the whole statement), the guests
+    are enqueued one by one with enqueue_guest() instead.
+
+    Returns a dict {guest_id: TOKEN_ADDED, GUEST_NOT_FOUND or GUEST_ALREADY_ENQUEUED}
+    (or QUEUE_NOT_FOUND if the queue has been deleted in the meantime).
+    """
+    # existing guests, each with its active token in this queue (if any):
+    rows = db.session.query(Guest.PK_Guest, Token.PK_Token).outerjoin(
+        Token, and_(Token.FK_Guest == Guest.PK_Guest,
+                    Token.FK_Queue == queue_id,
+                    Token.Status != -1)
+    ).filter(Guest.PK_Guest.in_(guest_ids)).all()
+    enqueued_ids = {guest_id for guest_id, token_id in rows if token_id is not None}
+    existing_ids = {guest_id for guest_id, token_id in rows}
+
+    results = {}
+    new_tokens = []
+    now = datetime.datetime.utcnow()
+    for guest_id in guest_ids:
+        if guest_id in results:
+            continue
+        if guest_id not in existing_ids:
+            results[guest_id] = GUEST_NOT_FOUND
+        elif guest_id in enqueued_ids:
+            results[guest_id] = GUEST_ALREADY_ENQUEUED
+        else:
+            results[guest_id] = TOKEN_ADDED
+            new_tokens.append({
+                'FK_Guest': guest_id,
+                'FK_Queue': queue_id,
+                'Status': 0,
+                'DateAndTime': now
+            })
+
+    if len(new_tokens) > 0:
+        try:
+            db.session.execute(Token.__table__.insert(), new_tokens)
+            db.session.commit()
+        except IntegrityError:
+            # a concurrent request has just enqueued one of the guests:
+            # check and enqueue each guest again, one at a time
+            db.session.rollback()
+            for token in new_tokens:
+                results[token['FK_Guest']] = enqueue_guest(queue_id, token['FK_Guest'])[0]
+            return results
+        except:
+            db.session.rollback()
+            raise
+        # the new tokens' keys are not known: reload the queue on next lookup
+        queue_index.invalidate(queue_id)
+
+    return results
+
 
 def update_token_by_id(token_id, token):
     """
@@ -420,6 +693,7 @@ def update_token_by_id(token_id, token):
     if target_token is not None:
         target_token.update(token)
         db.session.commit()
+        queue_index.invalidate()
         return True
     else:
         return False
@@ -434,6 +708,7 @@ def delete_tokens(queue_id):
     if target_tokens is not None:
         target_tokens.delete()
         db.session.commit()
+        queue_index.invalidate(queue_id)
         return True
     else:
         return False
@@ -448,6 +723,7 @@ def delete_token_by_id(token_id):
     if target_token is not None:
         target_token.delete()
         db.session.commit()
+        queue_index.invalidate()
         return True
     else:
         return False
@@ -516,10 +792,9 @@ def get_position_in_line(queue_id, guest_id):
     Returns -1 otherwise.
     """
     try:
-        # Call on a database SQL function GetPositionInLine(queue_id, guest_id)
-        result = db.session.query(
-            func.dbo.GetPositionInLine(queue_id, guest_id)).first()
-        return result[0]
+        # Look it up in the in-process queue index
+        # (replaces the dbo.GetPositionInLine(queue_id, guest_id) SQL function)
+        return queue_index.get_position_in_line(queue_id, guest_id)
     except:
         return -1
 
@@ -530,14 +805,78 @@ def get_people_enqueuing_count(queue_id):
     Returns -1 otherwise.
     """
     try:
-        # Call on a database SQL function GetPeopleEnqueingCount(queue_id, guest_id)
-        result = db.session.query(
-            func.dbo.GetPeopleEnqueingCount(queue_id)).first()
-        return result[0]
+        # Look it up in the in-process queue index
+        # (replaces the dbo.GetPeopleEnqueingCount(queue_id) SQL function)
+        return queue_index.get_people_enqueuing_count(queue_id)
     except:
         return -1
 
 
+def get_people_enqueuing_counts(queue_ids):
+    """
+    Returns a dict {queue_id: number of people enqueuing} for a list of Queues.
+    Queues that have not been looked up yet are loaded with a single query.
+    Returns -1 as the count of every queue otherwise.
+    """
+    try:
+        return queue_index.get_people_enqueuing_counts(queue_ids)
+    except:
+        return {queue_id: -1 for queue_id in queue_ids}
+
+
+def get_head_of_line(queue_id):
+    """
+    Returns the Id of the next guest to be served in a given Queue.
+    Returns None if nobody is waiting (or if the queue is not found).
+    """
+    try:
+        return queue_index.get_head_of_line(queue_id)
+    except:
+        return None
+
+
+def get_queue_info(queue_id, guest_id):
+    """
+    Returns the information a guest polls about a queue using a single
+    database round trip:
+    {
+        "pos_in_line": (int),
+        "number_of_people_enqueuing": (int),
+        "approximate_time_of_service": (float),
+        "service_time": (float)  # estimated from the observed service times
+    }
+
+    Returns None if the guest or the queue does not exist.
+    """
+    # check both guest and queue existence, and get the approximate time of
+    # service, with one query:
+    guest_id_subquery = db.session.query(Guest.PK_Guest).filter(
+        Guest.PK_Guest == guest_id).as_scalar()
+    result = db.session.query(
+        Queue.ApproximateTimeOfService, guest_id_subquery).filter(
+        Queue.PK_Queue == queue_id).first()
+
+    if result is None or result[1] is None:
+        return None
+
+    # position in line and count are served by the in-process queue index:
+    return {
+        "pos_in_line": get_position_in_line(queue_id, guest_id),
+        "number_of_people_enqueuing": get_people_enqueuing_count(queue_id),
+        "approximate_time_of_service": result[0],
+        "service_time": wait_time.get_service_time(queue_id, result[0])
+    }
+
+
+def uses_stored_procedures():
+    """
+    Returns True if the queue operations are executed by the SQL Server
+    stored procedures, and False if they are executed by the portable
+    SQLAlchemy engine (see app.config['QUEUE_ENGINE']).
+    """
+    return current_app.config.get('QUEUE_ENGINE', 'mssql') == 'mssql'
+
+
 def serve_guest(queue_id):
     """
     Executes Db procedure to serve the 1st person in line in a given Queue.
@@ -545,22 +884,22 @@ def serve_guest(queue_id):
     Returns guest_id (of the served guest) if guest has been served successfully.
     Returns -1 otherwise.
     """
-
-    connection = db.engine.raw_connection()
-    sql_query = """DECLARE @ServedGuestId INT
-        SET NOCOUNT ON
-        EXEC ServeGuest {}, @ServedGuestId OUTPUT
-        SELECT @ServedGuestId; """.format(queue_id)
-
     try:
-        cursor = connection.cursor()
-        cursor.execute(sql_query)
-        result = cursor.fetchone()
-        connection.commit()
-        return result[0]
+        if uses_stored_procedures():
+            served_guest_id = procedures.execute(
+                'ServeGuest', queue_id, with_output=True)
+        else:
+            served_guest_id = serve_guest_portable(queue_id)
     except:
+        db.session.rollback()
         return -1
 
+    if served_guest_id is not None and served_guest_id != -1:
+        queue_index.serve_guest(queue_id, served_guest_id)
+        wait_time.record_serve(queue_id, served_guest_id)
+        metrics.record_served(queue_id)
+    return served_guest_id
+
 
 def dequeue_guest(queue_id):
     """
@@ -569,21 +908,21 @@ def dequeue_guest(queue_id):
     Returns guest_id (of the served guest) if guest has been dequeued successfully.
     Returns -1 otherwise.
     """
-    connection = db.engine.raw_connection()
-    sql_query = """DECLARE @DequeuedGuestId INT
-        SET NOCOUNT ON
-        EXEC DequeueGuest {}, @DequeuedGuestId OUTPUT
-        SELECT @DequeuedGuestId;""".format(queue_id)
-
     try:
-        cursor = connection.cursor()
-        cursor.execute(sql_query)
-        result = cursor.fetchone()
-        connection.commit()
-        return result[0]
+        if uses_stored_procedures():
+            dequeued_guest_id = procedures.execute(
+                'DequeueGuest', queue_id, with_output=True)
+        else:
+            dequeued_guest_id = dequeue_guest_portable(queue_id)
     except:
+        db.session.rollback()
         return -1
 
+    if dequeued_guest_id is not None and dequeued_guest_id != -1:
+        queue_index.dequeue_guest(queue_id, dequeued_guest_id)
+        wait_time.record_dequeue(queue_id, dequeued_guest_id)
+    return dequeued_guest_id
+
 
 def close_queue(queue_id):
     """
@@ -593,36 +932,277 @@ def close_queue(queue_id):
     Returns True if queue has been closed successfully.
     Returns False otherwise.
     """
-    connection = db.session.connection()
-    sql_query = "EXEC CloseQueue @QueueId = {};".format(queue_id)
-
     try:
-        connection.execute(sql_query)
-        return True
+        if uses_stored_procedures():
+            procedures.execute('CloseQueue', queue_id)
+        elif not close_queue_portable(queue_id):
+            return False
     except:
+        db.session.rollback()
         return False
 
+    queue_index.close_queue(queue_id)
+    wait_time.close_queue(queue_id)
+    return True
 
-def add_otp(otp):
+
+# Portable queue engine:
+# Same operations as the ServeGuest, DequeueGuest and CloseQueue procedures,
+# written with SQLAlchemy so they run on any database (SQLite, Postgres...).
+# Each operation first locks the queue's row (SELECT ... FOR UPDATE, or
+# WITH (UPDLOCK, ROWLOCK) on SQL Server, whose SQLAlchemy 1.3 dialect ignores
+# FOR UPDATE), which serializes concurrent operations on the same queue.
+# SQLite has no row locks (and pysqlite runs the SELECTs outside of the
+# transaction), so the tokens are also claimed with conditional UPDATEs whose
+# row count tells whether this request won the race.
+
+# number of times serve_guest_portable() looks for the next guest again when
+# a concurrent request has taken it
+CLAIM_ATTEMPTS = 3
+
+
+def lock_queue(queue_id):
     """
-    adds OTP object to its table
+    Locks a given Queue's row until the end of the transaction.
+    Returns the queue if found. Returns None otherwise.
     """
-    db.session.add(otp)
+    return Queue.query.filter_by(PK_Queue=queue_id).with_for_update().with_hint(
+        Queue, 'WITH (UPDLOCK, ROWLOCK)', 'mssql').first()
+
+
+def serve_guest_portable(queue_id):
+    """
+    Marks the 1st guest waiting in a given Queue as being serviced.
+
+    Returns guest_id (of the served guest) if guest has been served successfully.
+    Returns -1 if the queue does not exist, if nobody is waiting, or if
+    someone is already being serviced.
+    """
+    served_guest_id = -1
+
+    if lock_queue(queue_id) is not None:
+        serviced_token = Token.__table__.alias()
+        nobody_serviced = ~exists().where(and_(
+            serviced_token.c.FK_Queue == queue_id, serviced_token.c.Status == 1))
+
+        for _ in range(CLAIM_ATTEMPTS):
+            next_token = db.session.query(Token.PK_Token, Token.FK_Guest).filter(
+                Token.FK_Queue == queue_id, Token.Status == 0).order_by(
+                Token.DateAndTime, Token.PK_Token).first()
+            if next_token is None:
+                break
+
+            # only serves the guest if still waiting and nobody is being
+            # serviced (checked by the same statement):
+            claimed_count = Token.query.filter(
+                Token.PK_Token == next_token.PK_Token, Token.Status == 0, nobody_serviced
+            ).update({Token.Status: 1}, synchronize_session=False)
+            if claimed_count == 1:
+                served_guest_id = next_token.FK_Guest
+                break
+
+            if not db.session.query(nobody_serviced).scalar():
+                # a concurrent request has served someone
+                break
+            # else the guest has left the line in the meantime: try the next one
+
     db.session.commit()
+    return served_guest_id
+
+
+def dequeue_guest_portable(queue_id):
+    """
+    Marks the guest being serviced in a given Queue as done.
+
+    Returns guest_id (of the dequeued guest) if guest has been dequeued successfully.
+    Returns -1 if the queue does not exist or if nobody is being serviced.
+    """
+    dequeued_guest_id = -1
+
+    if lock_queue(queue_id) is not None:
+        being_serviced = db.session.query(Token.PK_Token, Token.FK_Guest).filter(
+            Token.FK_Queue == queue_id, Token.Status == 1).first()
 
+        # only dequeues the guest if still being serviced (a concurrent
+        # request may have dequeued them in the meantime):
+        if being_serviced is not None and Token.query.filter(
+                Token.PK_Token == being_serviced.PK_Token, Token.Status == 1
+        ).update({Token.Status: -1}, synchronize_session=False) == 1:
+            dequeued_guest_id = being_serviced.FK_Guest
 
-def get_otp_by_guest_id(guest_id):
-    """ 
-    returns otp of a guest
-     """
-    return OTP.query.filter_by(FK_Guest=guest_id).first()
+    db.session.commit()
+    return dequeued_guest_id
 
 
-def check_otp_dal(guest_id, input_otp):
+def close_queue_portable(queue_id):
     """
-    Return a bool
+    Marks every token of a given Queue as done.
+
+    Returns True if queue has been closed successfully.
+    Returns False if the queue does not exist.
     """
-    record_otp = get_otp_by_guest_id(guest_id)
+    found = lock_queue(queue_id) is not None
 
-    result = record_otp.Value == input_otp
-    return result
+    if found:
+        Token.query.filter(Token.FK_Queue == queue_id, Token.Status != -1).update(
+            {Token.Status: -1}, synchronize_session=False)
+
+    db.session.commit()
+    return found
+
+
+# Archival:
+
+
+# number of times a batch is selected again when archived concurrently
+ARCHIVE_ATTEMPTS = 3
+
+
+def archive_tokens_batch(older_than, batch_size):
+    """
+    Moves (at most 'batch_size') finished tokens taken before 'older_than'
+    from the Token table to the TokenHistory table, in a single transaction.
+
+    The tokens are deleted first, and only archived if this transaction deleted
+    every one of them: if another archiver (another worker, or the 'flask
+    archive-tokens' command) got some of them first, the batch is rolled back
+    and selected again, so no token is archived twice.
+
+    Returns the number of archived tokens.
+    """
+    for _ in range(ARCHIVE_ATTEMPTS):
+        rows = db.session.query(
+            Token.PK_Token, Token.FK_Guest, Token.FK_Queue, Token.Status, Token.DateAndTime
+        ).filter(
+            Token.Status == -1, Token.DateAndTime < older_than
+        ).order_by(Token.PK_Token).limit(batch_size).all()
+
+        if len(rows) == 0:
+            db.session.rollback()
+            return 0
+
+        try:
+            # (blocks until a concurrent archiver holding these rows commits)
+            deleted_count = Token.query.filter(
+                Token.PK_Token.in_([row.PK_Token for row in rows]), Token.Status == -1
+            ).delete(synchronize_session=False)
+
+            if deleted_count != len(rows):
+                # archived concurrently: select the remaining tokens again
+                db.session.rollback()
+                continue
+
+            archived_at = datetime.datetime.utcnow()
+            db.session.execute(TokenHistory.__table__.insert(), [{
+                'FK_Token': row.PK_Token,
+                'FK_Guest': row.FK_Guest,
+                'FK_Queue': row.FK_Queue,
+                'Status': row.Status,
+                'DateAndTime': row.DateAndTime,
+                'ArchivedAt': archived_at
+            } for row in rows])
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+
+        return len(rows)
+
+    # (still racing with another archiver, which will archive these tokens)
+    return 0
+
+
+# Exports (streaming):
+# The following functions return queries that are iterated in batches of
+# EXPORT_BATCH_SIZE rows (server-side cursors where the driver supports it),
+# so exporting a whole table uses constant memory.
+
+EXPORT_BATCH_SIZE = 1000
+
+
+def stream(query, key_column):
+    """
+    Returns 'query' ordered by 'key_column' and fetched in batches.
+    """
+    return query.order_by(key_column).execution_options(
+        stream_results=True).yield_per(EXPORT_BATCH_SIZE)
+
+
+def filter_by_queue(query, model, queue_id=None, branch_id=None):
+    """
+    Returns 'query' (of tokens or archived tokens) restricted to a given
+    Queue and/or Branch.
+    """
+    if queue_id is not None:
+        query = query.filter(model.FK_Queue == queue_id)
+    if branch_id is not None:
+        query = query.join(Queue, Queue.PK_Queue == model.FK_Queue).filter(
+            Queue.FK_Branch == branch_id)
+    return query
+
+
+def iter_tokens(queue_id=None, branch_id=None, since=None, until=None):
+    """
+    Yields the tokens of a given Queue and/or Branch (all tokens if None)
+    taken between 'since' and 'until' (datetimes, both optional).
+    The archived tokens are exported by iter_token_history().
+    """
+    query = filter_by_queue(Token.query, Token, queue_id, branch_id)
+    if since is not None:
+        query = query.filter(Token.DateAndTime >= since)
+    if until is not None:
+        query = query.filter(Token.DateAndTime < until)
+    return stream(query, Token.PK_Token)
+
+
+def iter_token_history(queue_id=None, branch_id=None, since=None, until=None):
+    """
+    Yields the archived tokens of a given Queue and/or Branch (all archived
+    tokens if None) taken between 'since' and 'until' (datetimes, both optional).
+    """
+    query = filter_by_queue(TokenHistory.query, TokenHistory, queue_id, branch_id)
+    if since is not None:
+        query = query.filter(TokenHistory.DateAndTime >= since)
+    if until is not None:
+        query = query.filter(TokenHistory.DateAndTime < until)
+    return stream(query, TokenHistory.PK_TokenHistory)
+
+
+def iter_guests(queue_id=None, branch_id=None, since=None, until=None):
+    """
+    Yields the guests who enqueued in a given Queue and/or Branch (all guests
+    if None) registered between 'since' and 'until' (datetimes, both optional).
+
+    RegistrationDate is a date, so it is compared with whole days: guests
+    registered on the day of 'since' are included, and guests registered on
+    the day of 'until' only if 'until' is after midnight of that day.
+    """
+    query = Guest.query
+    if queue_id is not None or branch_id is not None:
+        # (including the guests whose tokens have been archived)
+        guest_ids = filter_by_queue(
+            db.session.query(Token.FK_Guest), Token, queue_id, branch_id).union(
+            filter_by_queue(db.session.query(TokenHistory.FK_Guest),
+                            TokenHistory, queue_id, branch_id))
+        query = query.filter(Guest.PK_Guest.in_(guest_ids.subquery()))
+    if since is not None:
+        query = query.filter(Guest.RegistrationDate >= since.date())
+    if until is not None:
+        until_date = until.date()
+        if until.time() != datetime.time():
+            until_date += datetime.timedelta(days=1)
+        query = query.filter(Guest.RegistrationDate < until_date)
+    return stream(query, Guest.PK_Guest)
+
+
+def iter_queues(queue_id=None, branch_id=None, since=None, until=None):
+    """
+    Yields a given Queue and/or the queues of a given Branch (all queues
+    if None). Queues have no date: 'since' and 'until' are ignored.
+    """
+    query = Queue.query
+    if queue_id is not None:
+        query = query.filter(Queue.PK_Queue == queue_id)
+    if branch_id is not None:
+        query = query.filter(Queue.FK_Branch == branch_id)
+    return stream(query, Queue.PK_Queue)
@@ -0,0 +1,110 @@
+# Read-through cache of the entities looked up by Id on (almost) every request.
+#
+# Each cache is a bounded LRU whose entries also expire after a TTL, which
+# bounds how stale an entry can be when the database is modified by another
+# process. Entries are invalidated by the DAL functions that update or delete
+# the corresponding entity.
+#
+# Cached entities are detached from the database session: they can be read
+# freely, but must not be modified (the DAL reloads entities before updating
+# them).
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# Configuration (can be overridden with environment variables):
+CACHE_SIZE = int(os.environ.get('ENTITY_CACHE_SIZE', 1024))
+CACHE_TTL = float(os.environ.get('ENTITY_CACHE_TTL', 60))  # seconds
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with a time-to-live, and hit/miss counters.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (expires_at, value)
+        self._entries = OrderedDict()
+        # incremented by every invalidation, so that a value loaded before
+        # an invalidation is not cached after it:
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, load):
+        """
+        Returns the cached value of 'key', or calls load() and caches its
+        result (None results are not cached).
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        value = load()
+
+        if value is not None:
+            with self._lock:
+                if generation != self._generation:
+                    return value
+                self._entries[key] = (now + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, key=None):
+        """
+        Removes 'key' from the cache (or every key if key is None).
+        """
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups > 0 else 0.0
+            }
+
+
+# One cache per entity:
+guests = LRUCache()
+establishments = LRUCache()
+branches = LRUCache()
+queues = LRUCache()
+
+
+def get_stats():
+    """
+    Returns the statistics of every entity cache.
+    """
+    return {
+        'guests': guests.get_stats(),
+        'establishments': establishments.get_stats(),
+        'branches': branches.get_stats(),
+        'queues': queues.get_stats()
+    }
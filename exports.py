@@ -0,0 +1,51 @@
+# NDJSON exports of the guests, tokens (active and archived) and queues (used by the '/exports'
+# blueprint and by the 'flask export' command).
+#
+# Records are read in batches and written one JSON document per line, so an
+# export never holds more than one batch of rows in memory.
+
+import datetime
+import json
+
+import dal  # import data access layer
+
+
+# export name -> Tuple(DAL generator, serializer)
+EXPORTS = {
+    'guests': (dal.iter_guests, lambda guest: guest.serialize()),
+    'tokens': (dal.iter_tokens, lambda token: token.serialize()),
+    # finished tokens moved out of the token table (see token_archive.py)
+    'token_history': (dal.iter_token_history, lambda token: token.serialize()),
+    # do not export the (heavy) QR codes
+    'queues': (dal.iter_queues, lambda queue: queue.serialize(
+        ['PK_Queue', 'FK_Branch', 'Name', 'ApproximateTimeOfService']))
+}
+
+
+def _to_json(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def parse_date(value):
+    """
+    Returns the datetime of an ISO 8601 string ('2021-05-01' or
+    '2021-05-01T08:30:00'), or None if value is None.
+    Raises ValueError if value is not a valid date.
+    """
+    if value is None:
+        return None
+    return datetime.datetime.fromisoformat(value)
+
+
+def generate_ndjson(name, queue_id=None, branch_id=None, since=None, until=None):
+    """
+    Yields the records of a given export ('guests', 'tokens', 'token_history'
+    or 'queues'),
+    one JSON line at a time.
+    """
+    iter_records, serialize = EXPORTS[name]
+    for record in iter_records(queue_id=queue_id, branch_id=branch_id,
+                               since=since, until=until):
+        yield json.dumps(serialize(record), default=_to_json) + '\n'
@@ -1,10 +1,14 @@
 import json
-import sms  # import SMS Module
+import sms_outbox  # import SMS outbox (sends SMS messages asynchronously)
 import dal  # import Data Access Layer
 import requests
 
 url = ""
 
+# page size of the collection endpoints ('?limit=', when paginated)
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
 # Helper functions:
 
 
@@ -25,9 +29,69 @@ def request_is_valid(request, keys_list):
     return True
 
 
+def get_requested_fields(request):
+    """
+    Returns the list of fields requested with the '?fields=' query string
+    parameter (comma-separated field names), e.g. '?fields=PK_Queue,Name'.
+
+    Returns None if all fields are requested.
+    """
+    fields = request.args.get('fields')
+    if fields is None or len(fields.strip()) == 0:
+        return None
+    return [field.strip() for field in fields.split(',') if len(field.strip()) > 0]
+
+
+def get_page_args(request):
+    """
+    Returns a Tuple(limit, after) from the '?limit=' and '?after=' query
+    string parameters of a collection endpoint:
+    - limit: number of items per page (DEFAULT_PAGE_SIZE by default,
+      MAX_PAGE_SIZE at most)
+    - after: the 'next_cursor' returned with the previous page (None for
+      the first page)
+
+    Returns (None, None) if neither parameter is given: clients that do not
+    paginate still get the whole collection.
+    """
+    if 'limit' not in request.args and 'after' not in request.args:
+        return (None, None)
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    after = request.args.get('after', type=int)
+    return (limit, after)
+
+
+def get_fetch_limit(limit):
+    """
+    Returns the number of items to fetch for a page of 'limit' items (one
+    more, to find out whether there is a next page), or None (every item) if
+    'limit' is None.
+    """
+    if limit is None:
+        return None
+    return limit + 1
+
+
+def get_page(items, limit, get_key):
+    """
+    Expects the items fetched with a limit of get_fetch_limit(limit).
+
+    Returns a Tuple(page_items, next_cursor):
+    - page_items: the first 'limit' items (every item if 'limit' is None)
+    - next_cursor: the key of the last item of the page if there are more
+      items, None otherwise
+    """
+    if limit is not None and len(items) > limit:
+        items = items[:limit]
+        return (items, get_key(items[-1]))
+    return (items, None)
+
+
 def send_sms_to_guest(guest_id, message_body):
     """
     Sends an SMS message to a guest with a given Id, and a message body.
+    The message is queued in the SMS outbox and sent in the background.
 
     Returns True if succeeds (i.e., guest exists in the database).
     Returns False otherwise.
@@ -38,4 +102,4 @@ def send_sms_to_guest(guest_id, message_body):
     if target_guest is not None:
         # get guest's phone number to be able to send the message
         target_phone_number = target_guest.PhoneNumber
-        sms.send_sms(target_phone_number, message_body)
+        sms_outbox.send_sms_async(target_phone_number, message_body)
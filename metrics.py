@@ -0,0 +1,334 @@
+# Metrics of the API, exposed in the Prometheus text format by 'GET /metrics'.
+#
+# Every metric is maintained incrementally by the code it measures (request
+# hooks, SMS outbox workers, Socket.IO handlers, queue operations), or read
+# from in-memory state when scraped (connection pool, queue index, wait time
+# estimates, entity caches): a scrape never queries the database.
+
+import bisect
+import threading
+import time
+from collections import deque
+
+from flask import g, request
+
+
+# Histogram buckets (in seconds):
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# window of the 'served per minute' gauges (in seconds):
+SERVED_WINDOW = 60.0
+
+_metrics = []
+_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                          for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """
+    Base class of the metrics: a value (or set of values) per label set.
+    """
+    type = 'untyped'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        with _lock:
+            _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.label_names)
+
+    def samples(self):
+        """
+        Returns the list of Tuple(name, labels, value) of this metric.
+        """
+        with _lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.type)]
+        for name, labels, value in self.samples():
+            lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [count per bucket (not cumulative)..., count above the last bucket], sum
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def samples(self):
+        samples = []
+        with _lock:
+            for key, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    samples.append((self.name + '_bucket', key + (('le', _format_value(float(bound))),), cumulative))
+                samples.append((self.name + '_count', key, cumulative))
+                samples.append((self.name + '_sum', key, total))
+        return samples
+
+
+class Collector(Metric):
+    """
+    Metric whose samples are read when scraped: collect() returns a list of
+    Tuple(labels dict, value).
+    """
+
+    def __init__(self, name, documentation, type, collect):
+        super().__init__(name, documentation)
+        self.type = type
+        self.collect = collect
+
+    def samples(self):
+        return [(self.name, tuple(sorted(labels.items())), value)
+                for labels, value in self.collect()]
+
+
+def render():
+    """
+    Returns every metric in the Prometheus text format.
+    """
+    with _lock:
+        metrics = list(_metrics)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# HTTP requests:
+
+http_requests = Counter(
+    'qme_http_requests_total', 'HTTP requests.', ['endpoint', 'method', 'status'])
+http_request_duration = Histogram(
+    'qme_http_request_duration_seconds', 'HTTP request latency.', ['endpoint', 'method'])
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+
+
+def _after_request(response):
+    if 'metrics_start' in g:
+        endpoint = request.endpoint or 'unknown'
+        http_request_duration.observe(
+            time.perf_counter() - g.metrics_start, endpoint=endpoint, method=request.method)
+        http_requests.inc(endpoint=endpoint, method=request.method,
+                          status=response.status_code)
+    return response
+
+
+def init_app(app):
+    """
+    Measures the requests of a given app.
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+
+
+# Socket.IO:
+
+socketio_connections = Gauge(
+    'qme_socketio_connections', 'Connected Socket.IO clients.')
+
+
+# SMS messages:
+
+sms_send_duration = Histogram(
+    'qme_sms_send_duration_seconds', 'SMS provider call latency.', ['outcome'])
+
+
+# Queues:
+
+queue_served = Counter(
+    'qme_queue_served_total', 'Guests served.', ['queue_id'])
+
+# queue_id -> deque of the times at which guests were served
+_served_times = {}
+
+
+def record_served(queue_id):
+    """
+    Records that a guest has been served in a given queue.
+    """
+    queue_served.inc(queue_id=queue_id)
+    now = time.monotonic()
+    with _lock:
+        times = _served_times.setdefault(queue_id, deque())
+        times.append(now)
+        while times[0] < now - SERVED_WINDOW:
+            times.popleft()
+
+
+def _collect_served_per_minute():
+    now = time.monotonic()
+    samples = []
+    with _lock:
+        for queue_id, times in _served_times.items():
+            while len(times) > 0 and times[0] < now - SERVED_WINDOW:
+                times.popleft()
+            samples.append(({'queue_id': queue_id}, len(times) * 60.0 / SERVED_WINDOW))
+    return samples
+
+
+def _collect_waiting():
+    import queue_index
+    return [({'queue_id': queue_id}, count)
+            for queue_id, count in queue_index.get_loaded_counts().items()]
+
+
+def _collect_eta():
+    # time remaining of the last guest waiting in each queue
+    import queue_index
+    import wait_time
+    service_times = wait_time.get_current_service_times()
+    return [({'queue_id': queue_id}, count * service_times[queue_id])
+            for queue_id, count in queue_index.get_loaded_counts().items()
+            if queue_id in service_times]
+
+
+def _collect_service_time():
+    import wait_time
+    return [({'queue_id': queue_id}, service_time)
+            for queue_id, service_time in wait_time.get_current_service_times().items()]
+
+
+Collector('qme_queue_waiting', 'Guests waiting in a queue.', 'gauge', _collect_waiting)
+Collector('qme_queue_served_per_minute', 'Guests served during the last minute.',
+          'gauge', _collect_served_per_minute)
+Collector('qme_queue_service_time_minutes', 'Estimated service time of a queue.',
+          'gauge', _collect_service_time)
+Collector('qme_queue_eta_minutes', 'Time remaining of the last guest waiting in a queue.',
+          'gauge', _collect_eta)
+
+
+# Database:
+
+def _collect_pool(attribute):
+    def collect():
+        from database import db
+        pool = db.engine.pool
+        if not hasattr(pool, attribute):
+            return []
+        return [({}, getattr(pool, attribute)())]
+    return collect
+
+
+def _collect_sql(key, scale=1):
+    def collect():
+        import sql_stats
+        return [({'endpoint': endpoint}, stats[key] * scale)
+                for endpoint, stats in sql_stats.get_stats().items()]
+    return collect
+
+
+Collector('qme_db_pool_size', 'Connection pool size.', 'gauge', _collect_pool('size'))
+Collector('qme_db_pool_checked_out', 'Connections in use.', 'gauge', _collect_pool('checkedout'))
+Collector('qme_db_pool_overflow', 'Connections above the pool size.', 'gauge', _collect_pool('overflow'))
+Collector('qme_sql_queries_total', 'SQL statements per endpoint.', 'counter', _collect_sql('queries'))
+Collector('qme_sql_duration_seconds_total', 'Database time per endpoint.',
+          'counter', _collect_sql('db_time_ms', 0.001))
+
+
+# Stored procedures:
+
+def _collect_procedures(key, scale=1):
+    def collect():
+        import procedures
+        return [({}, procedures.get_stats()[key] * scale)]
+    return collect
+
+
+Collector('qme_procedure_calls_total', 'Stored procedure calls.',
+          'counter', _collect_procedures('calls'))
+Collector('qme_procedure_errors_total', 'Failed stored procedure calls.',
+          'counter', _collect_procedures('errors'))
+Collector('qme_procedure_checkout_seconds_total',
+          'Time spent waiting for a pooled connection before a procedure call.',
+          'counter', _collect_procedures('checkout_seconds'))
+Collector('qme_procedure_execution_seconds_total', 'Stored procedure execution time.',
+          'counter', _collect_procedures('execution_seconds'))
+Collector('qme_procedure_checkout_max_seconds', 'Longest connection checkout of a procedure call.',
+          'gauge', _collect_procedures('max_checkout_ms', 0.001))
+Collector('qme_procedure_execution_max_seconds', 'Longest stored procedure execution.',
+          'gauge', _collect_procedures('max_execution_ms', 0.001))
+
+
+# Entity caches (for tuning ENTITY_CACHE_SIZE and ENTITY_CACHE_TTL):
+
+def _collect_entity_cache(key):
+    def collect():
+        import entity_cache
+        return [({'entity': entity}, stats[key])
+                for entity, stats in entity_cache.get_stats().items()]
+    return collect
+
+
+Collector('qme_entity_cache_hits_total', 'Entity lookups served by the cache.',
+          'counter', _collect_entity_cache('hits'))
+Collector('qme_entity_cache_misses_total', 'Entity lookups that queried the database.',
+          'counter', _collect_entity_cache('misses'))
+Collector('qme_entity_cache_evictions_total', 'Entities evicted from a full cache.',
+          'counter', _collect_entity_cache('evictions'))
+Collector('qme_entity_cache_size', 'Entities in the cache.',
+          'gauge', _collect_entity_cache('size'))
@@ -0,0 +1,23 @@
+-- Archive of the finished tokens (see token_archive.py).
+-- Run once against the production database (SQL Server).
+
+IF OBJECT_ID(N'dbo.token_history', N'U') IS NULL
+BEGIN
+    CREATE TABLE dbo.token_history (
+        PK_TokenHistory INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+        FK_Token INT NOT NULL,
+        FK_Guest INT NOT NULL,
+        FK_Queue INT NOT NULL,
+        Status INT NOT NULL,
+        DateAndTime DATETIME NOT NULL,
+        ArchivedAt DATETIME NOT NULL
+    );
+END
+GO
+
+-- finds the batches of tokens to archive without scanning the whole table:
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'ix_token_status_date_and_time')
+BEGIN
+    CREATE INDEX ix_token_status_date_and_time ON dbo.token (Status, DateAndTime);
+END
+GO
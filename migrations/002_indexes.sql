@@ -0,0 +1,41 @@
+-- Indexes of the hot lookup columns (declared in models.py).
+-- Run once against the production database (SQL Server).
+--
+-- The unique indexes cannot be created while the tables hold duplicates:
+-- list them first with the following queries (and merge/delete them).
+--
+--   SELECT PhoneNumber, COUNT(*) FROM dbo.guest GROUP BY PhoneNumber HAVING COUNT(*) > 1;
+--   SELECT Email, COUNT(*) FROM dbo.establishment GROUP BY Email HAVING COUNT(*) > 1;
+--   SELECT Email, COUNT(*) FROM dbo.branch GROUP BY Email HAVING COUNT(*) > 1;
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'ix_token_fk_queue_status_date_and_time')
+    CREATE INDEX ix_token_fk_queue_status_date_and_time ON dbo.token (FK_Queue, Status, DateAndTime);
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'ix_token_fk_queue_fk_guest')
+    CREATE INDEX ix_token_fk_queue_fk_guest ON dbo.token (FK_Queue, FK_Guest);
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'ux_guest_phone_number')
+    CREATE UNIQUE INDEX ux_guest_phone_number ON dbo.guest (PhoneNumber);
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'ux_establishment_email')
+    CREATE UNIQUE INDEX ux_establishment_email ON dbo.establishment (Email);
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'ux_branch_email')
+    CREATE UNIQUE INDEX ux_branch_email ON dbo.branch (Email);
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'ix_branch_fk_establishment')
+    CREATE INDEX ix_branch_fk_establishment ON dbo.branch (FK_Establishment);
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'ix_queue_fk_branch')
+    CREATE INDEX ix_queue_fk_branch ON dbo.queue (FK_Branch);
+GO
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'ix_otp_fk_guest')
+    CREATE INDEX ix_otp_fk_guest ON dbo.otp (FK_Guest);
+GO
@@ -0,0 +1,14 @@
+-- At most one active token per guest and queue (declared in models.py),
+-- which makes the conditional insert of dal.enqueue_guest race free.
+-- Run once against the production database (SQL Server).
+--
+-- The index cannot be created while the table holds duplicates: list them
+-- first with the following query (and mark the extra tokens as done).
+--
+--   SELECT FK_Queue, FK_Guest, COUNT(*) FROM dbo.token
+--   WHERE Status <> -1 GROUP BY FK_Queue, FK_Guest HAVING COUNT(*) > 1;
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'ux_token_active_fk_queue_fk_guest')
+    CREATE UNIQUE INDEX ux_token_active_fk_queue_fk_guest ON dbo.token (FK_Queue, FK_Guest)
+    WHERE Status <> -1;
+GO
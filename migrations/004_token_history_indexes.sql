@@ -0,0 +1,6 @@
+-- Index of the archived tokens exported per queue/branch (declared in models.py).
+-- Run once against the production database (SQL Server).
+
+IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name = N'ix_token_history_fk_queue_fk_guest')
+    CREATE INDEX ix_token_history_fk_queue_fk_guest ON dbo.token_history (FK_Queue, FK_Guest);
+GO
@@ -16,6 +16,11 @@ class Guest(db.Model):
     RegistrationDate = db.Column(
         db.Date, nullable=False, default=datetime.datetime.utcnow)
 
+    __table_args__ = (
+        # login and registration:
+        db.Index('ux_guest_phone_number', 'PhoneNumber', unique=True),
+    )
+
     def __init__(self, name, phone_number):
         self.Name = name
         self.PhoneNumber = phone_number
@@ -72,6 +77,11 @@ class Establishment(db.Model):
     Password = db.Column(db.String(60), nullable=False)
     PhoneNumber = db.Column(db.String(20), nullable=True)
 
+    __table_args__ = (
+        # login and registration:
+        db.Index('ux_establishment_email', 'Email', unique=True),
+    )
+
     def __init__(self, name, type, email, password, phone_number=None):
         self.Name = name
         self.Type = type
@@ -152,6 +162,13 @@ class Branch(db.Model):
     Latitude = db.Column(db.Float, nullable=True)
     Longitude = db.Column(db.Float, nullable=True)
 
+    __table_args__ = (
+        # login:
+        db.Index('ux_branch_email', 'Email', unique=True),
+        # branches of an establishment:
+        db.Index('ix_branch_fk_establishment', 'FK_Establishment'),
+    )
+
     def __init__(self, establishment_id, address, email, password, phone_number=None, latitude=None, longitude=None):
         self.FK_Establishment = establishment_id
         self.Address = address
@@ -228,20 +245,30 @@ class Queue(db.Model):
     FK_Branch = db.Column(db.Integer, nullable=False)
     Name = db.Column(db.String(20), nullable=False)
     ApproximateTimeOfService = db.Column(db.Float, nullable=False)
-    QrCode = db.Column(db.LargeBinary(8000), nullable=True)
+    # deferred: only loaded when accessed (or explicitly undeferred)
+    QrCode = db.deferred(db.Column(db.LargeBinary(8000), nullable=True))
+
+    __table_args__ = (
+        # queues of a branch:
+        db.Index('ix_queue_fk_branch', 'FK_Branch'),
+    )
 
     def __init__(self, branch_id, Name, ApproximateTimeOfService):
         self.FK_Branch = branch_id
         self.Name = Name
         self.ApproximateTimeOfService = ApproximateTimeOfService
 
-    def serialize(self):
-        if self.QrCode is not None:
-            decoded_qr_code = self.QrCode.decode('utf-8')
-        else:
-            decoded_qr_code = None
+    def serialize(self, fields=None):
+        """
+        Returns all fields, or only the given list of 'fields' if any
+        (QrCode is only loaded if requested).
+        """
+        decoded_qr_code = None
+        if fields is None or 'QrCode' in fields:
+            if self.QrCode is not None:
+                decoded_qr_code = self.QrCode.decode('utf-8')
 
-        return {
+        serialized = {
             'PK_Queue': self.PK_Queue,
             'FK_Branch': self.FK_Branch,
             'Name': self.Name,
@@ -250,6 +277,11 @@ class Queue(db.Model):
             'NumberOfPeopleEnqueuing': 0
         }
 
+        if fields is not None:
+            serialized = {key: value for key, value in serialized.items()
+                          if key in fields}
+        return serialized
+
     def update(new_queue):
         self.FK_Branch = new_queue.FK_Branch
         self.Name = new_queue.Name
@@ -295,6 +327,24 @@ class Token(db.Model):
     Status = db.Column(db.Integer, default=0, nullable=False)
     DateAndTime = db.Column(
         db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # waiting line of a queue (serve, position in line, count, index load):
+        db.Index('ix_token_fk_queue_status_date_and_time',
+                 'FK_Queue', 'Status', 'DateAndTime'),
+        # token of a guest in a queue:
+        db.Index('ix_token_fk_queue_fk_guest', 'FK_Queue', 'FK_Guest'),
+        # a guest has at most one active token per queue (filtered index,
+        # which guards dal.enqueue_guest against concurrent enqueues):
+        db.Index('ux_token_active_fk_queue_fk_guest', 'FK_Queue', 'FK_Guest',
+                 unique=True,
+                 mssql_where=Status != -1,
+                 postgresql_where=Status != -1,
+                 sqlite_where=Status != -1),
+        # finished tokens to archive (see token_archive.py):
+        db.Index('ix_token_status_date_and_time', 'Status', 'DateAndTime'),
+    )
+
     # 1. Deleted the field 'PositionInLine'
     # 2. Replaced it with an SQL Function that takes care of
     #    computing the PositionInLine
@@ -356,6 +406,36 @@ class Token(db.Model):
         return (is_valid, message)
 
 
+class TokenHistory(db.Model):
+    # Finished tokens (Status == -1) archived out of the Token table
+    # (see token_archive.py).
+    PK_TokenHistory = db.Column(db.Integer, primary_key=True)
+    # Id of the archived token:
+    FK_Token = db.Column(db.Integer, nullable=False)
+    FK_Guest = db.Column(db.Integer, nullable=False)
+    FK_Queue = db.Column(db.Integer, nullable=False)
+    Status = db.Column(db.Integer, nullable=False)
+    DateAndTime = db.Column(db.DateTime, nullable=False)
+    ArchivedAt = db.Column(
+        db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # archived tokens (and guests) of a queue (see dal.iter_token_history):
+        db.Index('ix_token_history_fk_queue_fk_guest', 'FK_Queue', 'FK_Guest'),
+    )
+
+    def serialize(self):
+        return {
+            'PK_TokenHistory': self.PK_TokenHistory,
+            'FK_Token': self.FK_Token,
+            'FK_Guest': self.FK_Guest,
+            'FK_Queue': self.FK_Queue,
+            'Status': self.Status,
+            'DateAndTime': self.DateAndTime,
+            'ArchivedAt': self.ArchivedAt,
+        }
+
+
 class CovidInfection(db.Model):
     PK_CovidInfection = db.Column(db.Integer, primary_key=True)
     FK_Guest = db.Column(db.Integer, nullable=False)
@@ -516,6 +596,11 @@ class OTP(db.Model):
     FK_Guest = db.Column(db.Integer, nullable=False)
     Value = db.Column(db.String(60), nullable=False)
 
+    __table_args__ = (
+        # OTP of a guest:
+        db.Index('ix_otp_fk_guest', 'FK_Guest'),
+    )
+
     def __init__(self, guest_id, otp):
         self.FK_Guest = guest_id
         self.Value = otp
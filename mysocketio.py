@@ -1,3 +1,72 @@
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room, leave_room
+
+import metrics
 
 socketio = SocketIO(cors_allowed_origins='*')
+
+
+# Rooms:
+# Clients only receive the events of the queues (or branches) they have
+# joined, instead of every event of every establishment.
+
+
+def queue_room(queue_id):
+    return 'queue-{}'.format(queue_id)
+
+
+def branch_room(branch_id):
+    return 'branch-{}'.format(branch_id)
+
+
+def get_rooms(data):
+    """
+    Returns the list of rooms requested by a 'join' or 'leave' event.
+    """
+    rooms = []
+    if isinstance(data, dict):
+        if data.get('queue_id') is not None:
+            rooms.append(queue_room(data.get('queue_id')))
+        if data.get('branch_id') is not None:
+            rooms.append(branch_room(data.get('branch_id')))
+    return rooms
+
+
+@socketio.on('connect')
+def on_connect():
+    metrics.socketio_connections.inc()
+
+
+@socketio.on('disconnect')
+def on_disconnect():
+    metrics.socketio_connections.dec()
+
+
+@socketio.on('join')
+def on_join(data):
+    """
+    Expects the following JSON Object:
+    {
+        "queue_id" : (int) /* (optional) guests waiting in a queue */,
+        "branch_id" : (int) /* (optional) branch dashboards */
+    }
+    """
+    for room in get_rooms(data):
+        join_room(room)
+
+
+@socketio.on('leave')
+def on_leave(data):
+    """
+    Expects the same JSON Object as the 'join' event.
+    """
+    for room in get_rooms(data):
+        leave_room(room)
+
+
+def emit_queue_event(event, json_obj, branch_id, queue_id):
+    """
+    Sends an event to the clients that joined the queue's room
+    and to the clients that joined the branch's room.
+    """
+    socketio.emit(event, json_obj, room=queue_room(queue_id))
+    socketio.emit(event, json_obj, room=branch_room(branch_id))
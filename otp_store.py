@@ -0,0 +1,202 @@
+# Store of the one-time passwords (OTP) sent to the guests.
+#
+# OTPs used to be rows of the OTP table that were never expired nor deleted
+# (and every check was a database query). Instead, they are kept in a store
+# where each OTP:
+# - expires after TTL seconds,
+# - is deleted once it has been checked successfully (single use),
+# - is deleted after MAX_ATTEMPTS wrong codes (brute force protection).
+#
+# Two stores are available (OTP_STORE environment variable):
+# - 'memory' (default): in-process dict whose expired entries are purged by a
+#   timing wheel, in O(1) amortized per operation. Like the other in-process
+#   state of the API, it assumes a single worker.
+# - 'redis': shared store (OTP_REDIS_URL), for several workers
+#   (requires the 'redis' package).
+#
+# OTPs are keyed by the guest's Id as an int (see guest_key()): the OTP stored
+# for guest 7 is found whether the check sends 7 or "7".
+
+import hmac
+import math
+import os
+import threading
+import time
+
+
+# Configuration (can be overridden with environment variables):
+TTL = float(os.environ.get('OTP_TTL', 300))  # seconds
+MAX_ATTEMPTS = int(os.environ.get('OTP_MAX_ATTEMPTS', 5))
+STORE = os.environ.get('OTP_STORE', 'memory')
+REDIS_URL = os.environ.get('OTP_REDIS_URL', 'redis://localhost:6379/0')
+
+# Results of check():
+VALID = 'valid'
+INVALID = 'invalid'
+EXPIRED = 'expired'  # (or never sent)
+TOO_MANY_ATTEMPTS = 'too_many_attempts'
+
+
+def guest_key(guest_id):
+    """
+    Returns the Id of a guest as an int (JSON bodies may send it as a string).
+    Raises ValueError if guest_id is not an integer.
+    """
+    if isinstance(guest_id, (bool, float)):
+        raise ValueError('guest_id must be an integer')
+    try:
+        return int(guest_id)
+    except TypeError:
+        raise ValueError('guest_id must be an integer')
+
+
+def _codes_match(expected, actual):
+    return hmac.compare_digest(str(expected).encode('utf-8'), str(actual).encode('utf-8'))
+
+
+class MemoryOtpStore:
+    """
+    In-process OTP store. Expired OTPs are purged by a timing wheel: each
+    OTP is also registered in the slot of the tick at which it expires, and
+    every operation first purges the slots of the ticks that have elapsed.
+    """
+
+    def __init__(self, ttl=TTL, max_attempts=MAX_ATTEMPTS, tick=1.0, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.tick = tick
+        self.clock = clock
+        # guest_id -> [code, expires_at, attempts]
+        self._entries = {}
+        # one slot (set of guest_ids) per tick, for a whole TTL:
+        self._wheel = [set() for _ in range(int(math.ceil(ttl / tick)) + 1)]
+        self._current_tick = int(clock() // tick)
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        """
+        Removes the OTPs that expired during the ticks elapsed since the last
+        purge.
+        """
+        now_tick = int(now // self.tick)
+        # (no need to go around the wheel more than once)
+        first_tick = max(self._current_tick, now_tick - len(self._wheel) + 1)
+        for tick in range(first_tick, now_tick + 1):
+            slot = self._wheel[tick % len(self._wheel)]
+            for guest_id in list(slot):
+                entry = self._entries.get(guest_id)
+                if entry is None or entry[1] <= now:
+                    slot.discard(guest_id)
+                    if entry is not None:
+                        del self._entries[guest_id]
+        self._current_tick = now_tick
+
+    def put(self, guest_id, code):
+        """
+        Stores the OTP of a guest (replacing the previous one, if any).
+        """
+        guest_id = guest_key(guest_id)
+        now = self.clock()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._purge(now)
+            self._entries[guest_id] = [code, expires_at, 0]
+            self._wheel[int(expires_at // self.tick) % len(self._wheel)].add(guest_id)
+
+    def check(self, guest_id, code):
+        """
+        Returns VALID, INVALID, EXPIRED or TOO_MANY_ATTEMPTS.
+        """
+        guest_id = guest_key(guest_id)
+        now = self.clock()
+        with self._lock:
+            self._purge(now)
+            entry = self._entries.get(guest_id)
+            if entry is None or entry[1] <= now:
+                self._entries.pop(guest_id, None)
+                return EXPIRED
+            if _codes_match(entry[0], code):
+                del self._entries[guest_id]
+                return VALID
+            entry[2] += 1
+            if entry[2] >= self.max_attempts:
+                del self._entries[guest_id]
+                return TOO_MANY_ATTEMPTS
+            return INVALID
+
+    def discard(self, guest_id):
+        guest_id = guest_key(guest_id)
+        with self._lock:
+            self._entries.pop(guest_id, None)
+
+    def __len__(self):
+        with self._lock:
+            self._purge(self.clock())
+            return len(self._entries)
+
+
+class RedisOtpStore:
+    """
+    OTP store shared by several workers (expiry is handled by Redis).
+    """
+
+    def __init__(self, client, ttl=TTL, max_attempts=MAX_ATTEMPTS, prefix='otp:'):
+        self.client = client
+        self.ttl = int(ttl)
+        self.max_attempts = max_attempts
+        self.prefix = prefix
+
+    def _keys(self, guest_id):
+        key = '{}{}'.format(self.prefix, guest_key(guest_id))
+        return (key, key + ':attempts')
+
+    def put(self, guest_id, code):
+        code_key, attempts_key = self._keys(guest_id)
+        pipeline = self.client.pipeline()
+        pipeline.set(code_key, str(code), ex=self.ttl)
+        pipeline.delete(attempts_key)
+        pipeline.execute()
+
+    def check(self, guest_id, code):
+        code_key, attempts_key = self._keys(guest_id)
+        expected = self.client.get(code_key)
+        if expected is None:
+            return EXPIRED
+        if _codes_match(expected.decode('utf-8'), code):
+            # only one concurrent check can delete the code:
+            if self.client.delete(code_key) == 1:
+                self.client.delete(attempts_key)
+                return VALID
+            return EXPIRED
+        pipeline = self.client.pipeline()
+        pipeline.incr(attempts_key)
+        pipeline.expire(attempts_key, self.ttl)
+        attempts = pipeline.execute()[0]
+        if attempts >= self.max_attempts:
+            self.client.delete(code_key, attempts_key)
+            return TOO_MANY_ATTEMPTS
+        return INVALID
+
+    def discard(self, guest_id):
+        self.client.delete(*self._keys(guest_id))
+
+
+# Store used by the API:
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    Returns the OTP store used by the API.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            if STORE == 'redis':
+                import redis  # only needed for the shared store
+                _store = RedisOtpStore(redis.Redis.from_url(REDIS_URL))
+            else:
+                _store = MemoryOtpStore()
+        return _store
@@ -0,0 +1,133 @@
+# Password hashing (bcrypt).
+#
+# bcrypt is deliberately slow (~250 ms per hash at cost 12) and CPU bound:
+# run inline under an eventlet worker, it freezes every other request of the
+# worker while it runs. Hashing and verification are therefore offloaded to a
+# dedicated pool of OS threads (eventlet's tpool when eventlet is patching the
+# standard library, a bounded ThreadPoolExecutor otherwise).
+#
+# The cost factor is configurable. Passwords hashed with another cost are
+# transparently rehashed when their owner logs in (see verify_password).
+
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+# Configuration (can be overridden with environment variables):
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+POOL_SIZE = int(os.environ.get('PASSWORD_HASHING_THREADS', 4))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _uses_eventlet():
+    """
+    Returns True if eventlet has monkey patched the threading module
+    (i.e., threads would be green threads sharing the hub).
+    """
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched('thread')
+
+
+def _run_in_pool(fn, *args):
+    """
+    Runs fn(*args) in the hashing thread pool and returns its result.
+    """
+    global _executor
+    if _uses_eventlet():
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=POOL_SIZE, thread_name_prefix='bcrypt')
+    return _executor.submit(fn, *args).result()
+
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return value
+
+
+def _to_str(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _hashpw(password, salt):
+    """
+    Returns bcrypt.hashpw(password, salt) as a string.
+    """
+    try:
+        # pyca's 'bcrypt' works with bytes...
+        hashed = bcrypt.hashpw(_to_bytes(password), _to_bytes(salt))
+    except TypeError:
+        # ...while 'python_bcrypt' works with strings
+        hashed = bcrypt.hashpw(_to_str(password), _to_str(salt))
+    return _to_str(hashed)
+
+
+def _hash(password, rounds):
+    return _hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password, hashed):
+    return hmac.compare_digest(
+        _to_bytes(_hashpw(password, hashed)), _to_bytes(hashed))
+
+
+def get_rounds(hashed):
+    """
+    Returns the cost factor of a bcrypt hash ('$2b$<cost>$...').
+    Returns None if the hash cannot be parsed.
+    """
+    try:
+        return int(_to_bytes(hashed).split(b'$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def hash_password(password, rounds=None):
+    """
+    Returns the bcrypt hash (string) of a password.
+    """
+    if rounds is None:
+        rounds = BCRYPT_ROUNDS
+    return _run_in_pool(_hash, password, rounds)
+
+
+def check_password(password, hashed):
+    """
+    Returns True if the password matches the bcrypt hash. Returns False otherwise.
+    """
+    try:
+        return _run_in_pool(_check, password, hashed)
+    except ValueError:
+        # not a valid bcrypt hash
+        return False
+
+
+def verify_password(password, hashed):
+    """
+    Returns a Tuple(is_valid, new_hash):
+    - is_valid: True if the password matches the bcrypt hash.
+    - new_hash: the password hashed with the current cost factor if it
+      is valid and was hashed with another cost. None otherwise.
+    """
+    if not check_password(password, hashed):
+        return (False, None)
+
+    if get_rounds(hashed) != BCRYPT_ROUNDS:
+        return (True, hash_password(password))
+    return (True, None)
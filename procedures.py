@@ -0,0 +1,119 @@
+# Execution of the database stored procedures (SQL Server).
+#
+# Every call borrows a connection from the engine's pool and always gives it
+# back, and passes its arguments as bound parameters: the statement text is
+# the same for every call of a given procedure, so SQL Server reuses a single
+# cached plan (and pyodbc reuses the prepared statement).
+#
+# Pool checkout and execution latencies are recorded and can be read with
+# get_stats() (and are exported on /metrics, see metrics.py).
+
+import threading
+import time
+from functools import lru_cache
+
+# import database:
+from database import db
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    'calls': 0,
+    'errors': 0,
+    'checkout_time': 0.0,
+    'max_checkout_time': 0.0,
+    'execution_time': 0.0,
+    'max_execution_time': 0.0
+}
+
+
+@lru_cache(maxsize=None)
+def _statement(procedure_name, arguments_count, with_output):
+    """
+    Returns the (cached) SQL statement calling a given procedure.
+    """
+    arguments = ['?'] * arguments_count
+    if with_output:
+        return """SET NOCOUNT ON
+        DECLARE @Result INT
+        EXEC {} {}
+        SELECT @Result;""".format(
+            procedure_name, ', '.join(arguments + ['@Result OUTPUT']))
+    else:
+        return """SET NOCOUNT ON
+        EXEC {} {};""".format(procedure_name, ', '.join(arguments))
+
+
+def _record(checkout_time, execution_time, failed):
+    with _stats_lock:
+        _stats['calls'] += 1
+        if failed:
+            _stats['errors'] += 1
+        _stats['checkout_time'] += checkout_time
+        _stats['max_checkout_time'] = max(
+            _stats['max_checkout_time'], checkout_time)
+        _stats['execution_time'] += execution_time
+        _stats['max_execution_time'] = max(
+            _stats['max_execution_time'], execution_time)
+
+
+def execute(procedure_name, *arguments, with_output=False):
+    """
+    Executes a stored procedure with the given (positional) arguments
+    and commits.
+
+    If 'with_output' is True, the procedure's last parameter is bound to an
+    INT OUTPUT variable, whose value is returned. Returns None otherwise.
+
+    Raises the database error if the procedure fails.
+    """
+    sql_query = _statement(procedure_name, len(arguments), with_output)
+
+    start = time.perf_counter()
+    connection = db.engine.raw_connection()  # borrow a pooled connection
+    checked_out = time.perf_counter()
+    failed = True
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql_query, arguments)
+        result = None
+        if with_output:
+            result = cursor.fetchone()[0]
+        cursor.close()
+        connection.commit()
+        failed = False
+        return result
+    except:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()  # give the connection back to the pool
+        _record(checked_out - start, time.perf_counter() - checked_out, failed)
+
+
+def get_stats():
+    """
+    Returns the procedure calls statistics (durations are in milliseconds,
+    totals in seconds) and the current state of the connection pool.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+
+    calls = stats['calls']
+    pool = db.engine.pool
+    return {
+        'calls': calls,
+        'errors': stats['errors'],
+        'checkout_seconds': stats['checkout_time'],
+        'execution_seconds': stats['execution_time'],
+        'avg_checkout_ms': stats['checkout_time'] * 1000 / calls if calls else 0.0,
+        'max_checkout_ms': stats['max_checkout_time'] * 1000,
+        'avg_execution_ms': stats['execution_time'] * 1000 / calls if calls else 0.0,
+        'max_execution_ms': stats['max_execution_time'] * 1000,
+        'cached_statements': _statement.cache_info().currsize,
+        'pool': {
+            'size': pool.size() if hasattr(pool, 'size') else None,
+            'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+            'overflow': pool.overflow() if hasattr(pool, 'overflow') else None
+        }
+    }
@@ -1,10 +1,24 @@
 #import png
 import qrcode
 import base64
+import hashlib
+import threading
+from collections import OrderedDict
 from io import BytesIO
 import io
 from models import Guest, Establishment, Branch, Token
 
+# maximum number of rendered QR codes kept in memory
+QR_CACHE_SIZE = 1024
+
+
+def get_endpoint_for_queue(establishment_id, branch_id, queue_id):
+    """
+    Returns the endpoint encoded in the QR Code of a queue
+    """
+    return '/establishments/{}/branches/{}/queues/{}/tokens'.format(
+        establishment_id, branch_id, queue_id)
+
 
 # generate QR code for queue
 # QR contains the endpoint name to which the client
@@ -16,12 +30,7 @@ def generate_qr_for_queue(establishment_id, branch_id, queue_id):
     """
     # encode the url of
 
-    establishment_id_str = str(establishment_id)
-    branch_id_str = str(branch_id)
-    queue_id_str = str(queue_id)
-
-    endpoint = '/establishments/{}/branches/{}/queues/{}/tokens'.format(
-        establishment_id, branch_id, queue_id)
+    endpoint = get_endpoint_for_queue(establishment_id, branch_id, queue_id)
 
     qr = qrcode.QRCode(
         version=1,
@@ -37,11 +46,14 @@ def generate_qr_for_queue(establishment_id, branch_id, queue_id):
 
 
 # img is PIL.Image.Image object, as returned from the QR generator
-def image_to_base64(img):
+def image_to_png(img):
     output_buffer = BytesIO()
     img.save(output_buffer, format='PNG')
-    byte_data = output_buffer.getvalue()
-    base64_str = base64.b64encode(byte_data)
+    return output_buffer.getvalue()
+
+
+def image_to_base64(img):
+    base64_str = base64.b64encode(image_to_png(img))
     return base64_str
 
 # take the encoded string, and convert it to a PIL Image
@@ -61,3 +73,45 @@ def qr_to_str(qr_code_img):
 # take PIL Image object and save it to path
 def save_image_to_path(img, path):
     img.save(path)
+
+
+# Cache of rendered QR codes:
+# The QR code of a queue only depends on the endpoint it encodes, so the PNG is
+# rendered once and kept in memory, keyed by the SHA-256 of that endpoint.
+# The same digest is used as the ETag of the image.
+
+_png_cache = OrderedDict()
+_png_cache_lock = threading.Lock()
+
+
+def get_qr_digest_for_queue(establishment_id, branch_id, queue_id):
+    """
+    Returns the digest identifying the QR Code of a queue
+    """
+    endpoint = get_endpoint_for_queue(establishment_id, branch_id, queue_id)
+    return hashlib.sha256(endpoint.encode('utf-8')).hexdigest()
+
+
+def get_qr_png_for_queue(establishment_id, branch_id, queue_id):
+    """
+    Returns a Tuple(png_bytes, digest) holding the QR Code of a queue.
+    The QR Code is only rendered the first time it is requested.
+    """
+    digest = get_qr_digest_for_queue(establishment_id, branch_id, queue_id)
+
+    with _png_cache_lock:
+        png = _png_cache.get(digest)
+        if png is not None:
+            _png_cache.move_to_end(digest)
+            return (png, digest)
+
+    png = image_to_png(generate_qr_for_queue(
+        establishment_id, branch_id, queue_id))
+
+    with _png_cache_lock:
+        _png_cache[digest] = png
+        if len(_png_cache) > QR_CACHE_SIZE:
+            # evict the least recently used QR code
+            _png_cache.popitem(last=False)
+
+    return (png, digest)
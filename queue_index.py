@@ -0,0 +1,295 @@
+# In-process index of the guests enqueuing in each Queue.
+#
+# The position in line and the number of people enqueuing used to be computed
+# by the dbo.GetPositionInLine and dbo.GetPeopleEnqueingCount SQL functions,
+# which rescan the Token table on every poll. Instead, each queue keeps its
+# waiting tokens in a SortedList ordered by (DateAndTime, PK_Token), which
+# makes both lookups O(log n) memory operations. The database is only read
+# the first time a queue is looked up (or after it has been invalidated).
+#
+# The index is kept in sync by the DAL functions that mutate tokens, so it is
+# only accurate as long as every write goes through this process (i.e., the
+# API runs as a single worker, which Flask-SocketIO already requires).
+#
+# Queues are loaded outside of the lock, and mutations of a queue that is not
+# loaded are not applied: every mutation bumps the queue's generation, and a
+# load whose queue has been mutated in the meantime is not published (it may
+# have missed the mutation), but loaded again.
+
+import threading
+
+from sortedcontainers import SortedList
+
+from models import Token
+
+
+# Token statuses (see models.Token):
+WAITING = 0
+BEING_SERVICED = 1
+DONE = -1
+
+
+class QueueIndex:
+    """
+    Ordered view over the active tokens of a single queue.
+    """
+
+    def __init__(self):
+        # (DateAndTime, PK_Token, FK_Guest) of every waiting token:
+        self.waiting = SortedList()
+        # FK_Guest -> entry inside 'waiting':
+        self.entries = {}
+        # FK_Guest of the guests being serviced:
+        self.serving = set()
+
+    def add(self, guest_id, token_id, date_and_time, status=WAITING):
+        self.remove(guest_id)
+        if status == WAITING:
+            entry = (date_and_time, token_id, guest_id)
+            self.waiting.add(entry)
+            self.entries[guest_id] = entry
+        elif status == BEING_SERVICED:
+            self.serving.add(guest_id)
+
+    def remove(self, guest_id):
+        entry = self.entries.pop(guest_id, None)
+        if entry is not None:
+            self.waiting.remove(entry)
+        self.serving.discard(guest_id)
+
+    def serve(self, guest_id):
+        self.remove(guest_id)
+        self.serving.add(guest_id)
+
+    def position_of(self, guest_id):
+        """
+        Returns the 1-based position of a waiting guest,
+        0 if the guest is being serviced, and -1 otherwise.
+        """
+        entry = self.entries.get(guest_id)
+        if entry is not None:
+            return self.waiting.index(entry) + 1
+        if guest_id in self.serving:
+            return 0
+        return -1
+
+    def count(self):
+        return len(self.waiting)
+
+    def head(self):
+        """
+        Returns the FK_Guest of the first guest waiting, or None.
+        """
+        if len(self.waiting) > 0:
+            return self.waiting[0][2]
+        return None
+
+
+# number of attempts to load (and publish) a queue that is being mutated
+MAX_LOAD_ATTEMPTS = 3
+
+# queue_id -> QueueIndex
+_indexes = {}
+# queue_id -> number of mutations/invalidations of the queue
+_generations = {}
+# number of invalidations of every queue
+_generation = 0
+_lock = threading.RLock()
+
+
+def _generation_of(queue_id):
+    """
+    Returns the current generation of a queue (the caller holds _lock).
+    """
+    return (_generation, _generations.get(queue_id, 0))
+
+
+def _touch(queue_id):
+    """
+    Bumps the generation of a queue (the caller holds _lock).
+    """
+    _generations[queue_id] = _generations.get(queue_id, 0) + 1
+
+
+def _build(tokens):
+    """
+    Returns a dict {queue_id: QueueIndex} built from a list of active tokens.
+    """
+    indexes = {}
+    for token in tokens:
+        queue_index = indexes.setdefault(token.FK_Queue, QueueIndex())
+        queue_index.add(token.FK_Guest, token.PK_Token,
+                        token.DateAndTime, token.Status)
+    return indexes
+
+
+def _get(queue_id):
+    """
+    Returns the index of a given queue, loading it from the database if needed.
+    """
+    return _get_many([queue_id])[queue_id]
+
+
+def _get_many(queue_ids):
+    """
+    Returns a dict {queue_id: QueueIndex} for the given queues. The queues
+    that are not loaded yet are loaded from the database with a single query.
+    """
+    with _lock:
+        result = {queue_id: _indexes.get(queue_id) for queue_id in queue_ids}
+        # queue_id -> generation when the load started
+        missing = {queue_id: _generation_of(queue_id)
+                   for queue_id, queue_index in result.items() if queue_index is None}
+
+    for _ in range(MAX_LOAD_ATTEMPTS):
+        if len(missing) == 0:
+            break
+
+        tokens = Token.query.filter(
+            Token.FK_Queue.in_(list(missing)), Token.Status != DONE).all()
+        loaded = _build(tokens)
+
+        with _lock:
+            mutated = {}
+            for queue_id, generation in missing.items():
+                queue_index = _indexes.get(queue_id)
+                if queue_index is None:
+                    queue_index = loaded.get(queue_id, QueueIndex())
+                    if _generation_of(queue_id) == generation:
+                        _indexes[queue_id] = queue_index
+                    else:
+                        # mutated during the load: load it again
+                        mutated[queue_id] = _generation_of(queue_id)
+                # (else another request has loaded it in the meantime)
+                result[queue_id] = queue_index
+            missing = mutated
+
+    # (a queue still being mutated after MAX_LOAD_ATTEMPTS is returned, but not
+    # published: it will be loaded again on the next lookup)
+    return result
+
+
+def rebuild():
+    """
+    Reloads the index of every queue from the database (one query).
+    """
+    with _lock:
+        generation = _generation
+        generations = dict(_generations)
+
+    tokens = Token.query.filter(Token.Status != DONE).all()
+    indexes = _build(tokens)
+
+    with _lock:
+        if _generation != generation:
+            # every queue has been invalidated in the meantime
+            return
+        _indexes.clear()
+        for queue_id, queue_index in indexes.items():
+            # (queues mutated in the meantime are loaded again on lookup)
+            if _generations.get(queue_id, 0) == generations.get(queue_id, 0):
+                _indexes[queue_id] = queue_index
+
+
+def invalidate(queue_id=None):
+    """
+    Drops the index of a given queue (or of all queues if queue_id is None).
+    It will be reloaded from the database on the next lookup.
+    """
+    global _generation
+    with _lock:
+        if queue_id is None:
+            _generation += 1
+            _indexes.clear()
+        else:
+            _touch(queue_id)
+            _indexes.pop(queue_id, None)
+
+
+# Lookups:
+# (the indexes are keyed by the integer FK_Queue and FK_Guest columns, while
+# the Ids of a JSON body may be strings: they are converted with int(), which
+# raises ValueError if an Id is not an integer)
+
+
+def get_position_in_line(queue_id, guest_id):
+    """
+    Returns the Position in Line of a given Guest if found.
+    Returns -1 otherwise.
+    """
+    queue_index = _get(int(queue_id))
+    with _lock:
+        return queue_index.position_of(int(guest_id))
+
+
+def get_people_enqueuing_count(queue_id):
+    """
+    Returns the number of people waiting in a given Queue.
+    """
+    queue_index = _get(int(queue_id))
+    with _lock:
+        return queue_index.count()
+
+
+def get_people_enqueuing_counts(queue_ids):
+    """
+    Returns a dict {queue_id: number of people waiting} for the given queues.
+    """
+    queue_indexes = _get_many([int(queue_id) for queue_id in queue_ids])
+    with _lock:
+        return {queue_id: queue_index.count()
+                for queue_id, queue_index in queue_indexes.items()}
+
+
+def get_head_of_line(queue_id):
+    """
+    Returns the Id of the next guest to be served in a given Queue,
+    or None if nobody is waiting.
+    """
+    queue_index = _get(int(queue_id))
+    with _lock:
+        return queue_index.head()
+
+
+def get_loaded_counts():
+    """
+    Returns a dict {queue_id: number of people waiting} for the queues that
+    are currently loaded (never reads the database).
+    """
+    with _lock:
+        return {queue_id: queue_index.count()
+                for queue_id, queue_index in _indexes.items()}
+
+
+# Mutations (called by the DAL once the database has been updated):
+
+
+def add_token(queue_id, guest_id, token_id, date_and_time):
+    with _lock:
+        _touch(queue_id)
+        queue_index = _indexes.get(queue_id)
+        if queue_index is not None:
+            queue_index.add(guest_id, token_id, date_and_time)
+
+
+def serve_guest(queue_id, guest_id):
+    with _lock:
+        _touch(queue_id)
+        queue_index = _indexes.get(queue_id)
+        if queue_index is not None:
+            queue_index.serve(guest_id)
+
+
+def dequeue_guest(queue_id, guest_id):
+    with _lock:
+        _touch(queue_id)
+        queue_index = _indexes.get(queue_id)
+        if queue_index is not None:
+            queue_index.remove(guest_id)
+
+
+def close_queue(queue_id):
+    with _lock:
+        _touch(queue_id)
+        # every guest has been dequeued => the queue is now empty
+        _indexes[queue_id] = QueueIndex()
@@ -0,0 +1,237 @@
+# Rate limiting of the expensive endpoints (token buckets).
+#
+# Some endpoints cost much more than others (an SMS sent through Twilio,
+# a bcrypt hash, ...), so a single abusive client can saturate the workers.
+# Each limited endpoint has token buckets per client IP and (optionally) per
+# identity (phone number, email, guest Id...): a bucket holds at most N
+# tokens, refilled at N tokens per period, and every request takes one token.
+# Requests finding an empty bucket are answered with 429 Too Many Requests.
+#
+# The limits are declared on each route with @rate_limit.limit(...), and can
+# be overridden per endpoint with app.config['RATE_LIMITS']:
+#   {'auth.login_branch': {'per_ip': '20/minute', 'per_identity': '5/minute'}}
+# (app.config['RATE_LIMIT_ENABLED'] = False disables every limit).
+#
+# Buckets are kept in-process by default, or in Redis (shared by several
+# workers) with RATE_LIMIT_BACKEND=redis (requires the 'redis' package).
+#
+# Clients are identified by the address that the outermost of RATE_LIMIT_PROXIES
+# reverse proxies appended to X-Forwarded-For. The default is 1 on Azure App
+# Service (WEBSITE_SITE_NAME is set), whose front end always sets the header,
+# and on Heroku (DYNO), else 0: the header is ignored, since any client can
+# forge it. Set RATE_LIMIT_PROXIES=0 if the API is exposed directly, or to the
+# number of proxies in front of it (e.g. 2 behind a CDN or Front Door).
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, jsonify, request
+
+import metrics
+
+
+# Configuration (can be overridden with environment variables):
+BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+# maximum number of buckets kept in memory (least recently used are dropped):
+MAX_BUCKETS = int(os.environ.get('RATE_LIMIT_MAX_BUCKETS', 100000))
+# number of trusted reverse proxies in front of the API (Azure App Service's
+# front end or Heroku's router => 1):
+_BEHIND_PROXY = 'WEBSITE_SITE_NAME' in os.environ or 'DYNO' in os.environ
+PROXIES = int(os.environ.get('RATE_LIMIT_PROXIES', 1 if _BEHIND_PROXY else 0))
+
+_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+_LIMIT_PATTERN = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)s?\s*$')
+# "1.2.3.4:5678" or "[::1]:5678" (Azure's front end appends the client port):
+_PORT_PATTERN = re.compile(r'^(?:\[([0-9a-fA-F:.]+)\]|(\d+\.\d+\.\d+\.\d+)):\d+$')
+
+throttled_requests = metrics.Counter(
+    'qme_rate_limited_requests_total', 'Requests rejected by the rate limiter.',
+    ['endpoint', 'scope'])
+
+
+def parse_limit(limit):
+    """
+    Returns a Tuple(capacity, rate per second) from a limit such as
+    '5/minute', '100/hour' or '3/10minutes'.
+    Raises ValueError if the limit is invalid.
+    """
+    match = _LIMIT_PATTERN.match(limit)
+    if match is None:
+        raise ValueError("Invalid rate limit '{}'.".format(limit))
+    count = int(match.group(1))
+    period = int(match.group(2) or 1) * _PERIODS[match.group(3)]
+    return (count, count / period)
+
+
+class MemoryBackend:
+    """
+    In-process token buckets.
+    """
+
+    def __init__(self, max_buckets=MAX_BUCKETS, clock=time.monotonic):
+        self.max_buckets = max_buckets
+        self.clock = clock
+        # key -> [tokens, updated_at]
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate):
+        """
+        Takes a token from a bucket.
+        Returns a Tuple(allowed, retry_after in seconds).
+        """
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(capacity), now]
+                while len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return (True, 0.0)
+            return (False, (1 - bucket[0]) / rate)
+
+
+class RedisBackend:
+    """
+    Token buckets shared by several workers (updated atomically by a script).
+    """
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+    local updated_at = tonumber(redis.call('HGET', KEYS[1], 'updated_at'))
+    if tokens == nil then
+        tokens = capacity
+    else
+        tokens = math.min(capacity, tokens + (now - updated_at) * rate)
+    end
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, client, prefix='rate_limit:'):
+        self.prefix = prefix
+        self._script = client.register_script(self.SCRIPT)
+
+    def consume(self, key, capacity, rate):
+        allowed, tokens = self._script(
+            keys=[self.prefix + key], args=[capacity, rate, time.time()])
+        if allowed == 1:
+            return (True, 0.0)
+        return (False, (1 - float(tokens)) / rate)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Returns the buckets backend used by the API.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if BACKEND == 'redis':
+                import redis  # only needed for the shared backend
+                _backend = RedisBackend(redis.Redis.from_url(REDIS_URL))
+            else:
+                _backend = MemoryBackend()
+        return _backend
+
+
+def get_client_ip():
+    """
+    Returns the IP address of the client (as seen by the first proxy).
+    """
+    if PROXIES > 0 and len(request.access_route) >= PROXIES:
+        address = request.access_route[-PROXIES]
+        # (without the port, else every connection would get its own bucket)
+        match = _PORT_PATTERN.match(address)
+        if match is not None:
+            return match.group(1) or match.group(2)
+        return address
+    return request.remote_addr
+
+
+def json_field(name):
+    """
+    Returns an identity function reading a given field of the JSON body.
+    """
+    def identity():
+        json_obj = request.get_json(silent=True)
+        if isinstance(json_obj, dict) and json_obj.get(name) is not None:
+            return str(json_obj.get(name))
+        return None
+    return identity
+
+
+def _too_many_requests(retry_after):
+    response = jsonify(
+        status=429,
+        message="Too many requests. Please try again in {} second(s).".format(
+            int(retry_after) + 1)
+    )
+    response.status_code = 429
+    response.headers['Retry-After'] = str(int(retry_after) + 1)
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+
+def limit(per_ip=None, per_identity=None, identity=None):
+    """
+    Decorator limiting a route to 'per_ip' requests per client IP, and to
+    'per_identity' requests per identity() (e.g., json_field('email')).
+    """
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            if not current_app.config.get('RATE_LIMIT_ENABLED', True):
+                return fn(*args, **kwargs)
+
+            endpoint = request.endpoint
+            limits = current_app.config.get('RATE_LIMITS', {}).get(endpoint, {})
+            checks = [
+                ('ip', limits.get('per_ip', per_ip), get_client_ip),
+                ('identity', limits.get('per_identity', per_identity), identity)
+            ]
+
+            backend = get_backend()
+            for scope, limit_value, get_key in checks:
+                if limit_value is None or get_key is None:
+                    continue
+                key = get_key()
+                if key is None:
+                    continue
+                capacity, rate = parse_limit(limit_value)
+                allowed, retry_after = backend.consume(
+                    '{}:{}:{}'.format(endpoint, scope, key), capacity, rate)
+                if not allowed:
+                    throttled_requests.inc(endpoint=endpoint, scope=scope)
+                    return _too_many_requests(retry_after)
+
+            return fn(*args, **kwargs)
+
+        return decorator
+
+    return wrapper
@@ -0,0 +1,261 @@
+# Asynchronous SMS outbox.
+#
+# Sending an SMS through Twilio is an HTTPS round trip, which used to be part
+# of the latency of the endpoints that send one (and a Twilio outage used to
+# stall them). Instead, messages are written to a local SQLite outbox and
+# drained by a bounded pool of worker threads:
+# - failed messages are retried with exponential backoff,
+# - messages failing 'max_attempts' times are moved to the dead-letter list,
+# - messages that were being sent when the process stopped are sent again
+#   on the next start.
+#
+# The transport is any callable(to_phone_number, message_body), which makes
+# it possible to benchmark the outbox offline with FakeTransport.
+
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# Configuration (can be overridden with environment variables):
+OUTBOX_PATH = os.environ.get('SMS_OUTBOX_PATH', 'sms_outbox.db')
+WORKERS = int(os.environ.get('SMS_OUTBOX_WORKERS', 4))
+MAX_ATTEMPTS = int(os.environ.get('SMS_OUTBOX_MAX_ATTEMPTS', 5))
+# 'twilio' or 'fake':
+TRANSPORT = os.environ.get('SMS_TRANSPORT', 'twilio')
+
+# Message statuses:
+PENDING = 'pending'
+SENDING = 'sending'
+DEAD = 'dead'
+
+
+class FakeTransport:
+    """
+    Local transport that does not send anything.
+    Simulates the latency and the failure rate of the SMS provider.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def __call__(self, to_phone_number, message_body):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise IOError("Simulated SMS provider failure.")
+        with self._lock:
+            self.sent.append((to_phone_number, message_body))
+
+
+class SmsOutbox:
+    """
+    Persisted queue of SMS messages drained by a pool of worker threads.
+    """
+
+    def __init__(self, transport, path=OUTBOX_PATH, workers=WORKERS,
+                 max_attempts=MAX_ATTEMPTS, backoff=2.0, poll_interval=1.0,
+                 verbose=True):
+        self.transport = transport
+        self.workers_count = workers
+        self.max_attempts = max_attempts
+        # delay (in seconds) before the 1st retry, doubled at every attempt:
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.verbose = verbose
+
+        self.sent_count = 0
+        self.failed_attempts_count = 0
+
+        self._workers = []
+        self._running = False
+        self._condition = threading.Condition()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_phone_number TEXT NOT NULL,
+            message_body TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT)""")
+        # messages interrupted by a previous shutdown must be sent again:
+        self._connection.execute(
+            "UPDATE outbox SET status = ? WHERE status = ?", (PENDING, SENDING))
+        self._connection.commit()
+
+    # Producer side:
+
+    def submit(self, to_phone_number, message_body):
+        """
+        Adds a message to the outbox. Returns the message Id.
+        """
+        with self._condition:
+            cursor = self._connection.execute(
+                "INSERT INTO outbox (to_phone_number, message_body, status, next_attempt_at) "
+                "VALUES (?, ?, ?, ?)",
+                (to_phone_number, message_body, PENDING, time.time()))
+            self._connection.commit()
+            self._condition.notify()
+            return cursor.lastrowid
+
+    def pending_count(self):
+        """
+        Returns the number of messages that have not been sent yet.
+        """
+        with self._condition:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status != ?", (DEAD,)).fetchone()[0]
+
+    def dead_letters(self):
+        """
+        Returns the list of messages that could not be sent.
+        """
+        with self._condition:
+            rows = self._connection.execute(
+                "SELECT id, to_phone_number, message_body, attempts, last_error "
+                "FROM outbox WHERE status = ? ORDER BY id", (DEAD,)).fetchall()
+        return [{
+            'id': row[0],
+            'to_phone_number': row[1],
+            'message_body': row[2],
+            'attempts': row[3],
+            'last_error': row[4]
+        } for row in rows]
+
+    def retry_dead_letters(self):
+        """
+        Moves every dead letter back to the outbox.
+        """
+        with self._condition:
+            self._connection.execute(
+                "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ? "
+                "WHERE status = ?", (PENDING, time.time(), DEAD))
+            self._connection.commit()
+            self._condition.notify_all()
+
+    # Worker side:
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        for _ in range(self.workers_count):
+            worker = threading.Thread(target=self._work, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def _claim(self):
+        """
+        Marks the next message due as being sent.
+        Returns Tuple(id, to_phone_number, message_body, attempts) or None.
+        """
+        row = self._connection.execute(
+            "SELECT id, to_phone_number, message_body, attempts FROM outbox "
+            "WHERE status = ? AND next_attempt_at <= ? ORDER BY id LIMIT 1",
+            (PENDING, time.time())).fetchone()
+        if row is not None:
+            self._connection.execute(
+                "UPDATE outbox SET status = ? WHERE id = ?", (SENDING, row[0]))
+            self._connection.commit()
+        return row
+
+    def _work(self):
+        while True:
+            with self._condition:
+                message = None
+                while self._running:
+                    message = self._claim()
+                    if message is not None:
+                        break
+                    self._condition.wait(self.poll_interval)
+                if message is None:
+                    return
+
+            message_id, to_phone_number, message_body, attempts = message
+            start = time.perf_counter()
+            try:
+                self.transport(to_phone_number, message_body)
+            except Exception as e:
+                metrics.sms_send_duration.observe(
+                    time.perf_counter() - start, outcome='failed')
+                self._on_failure(message_id, attempts + 1, e)
+            else:
+                metrics.sms_send_duration.observe(
+                    time.perf_counter() - start, outcome='sent')
+                self._on_success(message_id)
+
+    def _on_success(self, message_id):
+        with self._condition:
+            self._connection.execute(
+                "DELETE FROM outbox WHERE id = ?", (message_id,))
+            self._connection.commit()
+            self.sent_count += 1
+
+    def _on_failure(self, message_id, attempts, error):
+        with self._condition:
+            self.failed_attempts_count += 1
+            if attempts >= self.max_attempts:
+                status = DEAD
+            else:
+                status = PENDING
+            next_attempt_at = time.time() + self.backoff * 2 ** (attempts - 1)
+            self._connection.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? "
+                "WHERE id = ?",
+                (status, attempts, next_attempt_at, str(error), message_id))
+            self._connection.commit()
+        if self.verbose:
+            logger.warning("Failed to send SMS message #%s (attempt %s/%s): %s",
+                           message_id, attempts, self.max_attempts, error)
+
+
+# Default outbox used by the API:
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    """
+    Returns the outbox used by the API, starting its workers if needed.
+    """
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            if TRANSPORT == 'fake':
+                transport = FakeTransport()
+            else:
+                import sms  # only needed (and configured) for real messages
+                transport = sms.send_sms
+            _outbox = SmsOutbox(transport)
+            _outbox.start()
+        return _outbox
+
+
+def send_sms_async(to_phone_number, message_body):
+    """
+    Queues an SMS message to the specified destination phone number.
+    The message is sent in the background.
+    """
+    get_outbox().submit(to_phone_number, message_body)
@@ -0,0 +1,123 @@
+# Per-request SQL instrumentation.
+#
+# Counts the SQL statements and the database time of every request (with
+# SQLAlchemy cursor events), and:
+# - adds them to the response headers (X-SQL-Queries, X-SQL-Time-Ms) in debug
+#   mode (or if SQL_STATS_HEADERS is set),
+# - logs a warning for the requests issuing more than SQL_QUERY_BUDGET
+#   statements,
+# - aggregates them per endpoint (see get_stats()).
+
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Configuration (can be overridden with environment variables or app.config):
+QUERY_BUDGET = int(os.environ.get('SQL_QUERY_BUDGET', 10))
+
+# endpoint -> {requests, queries, max_queries, db_time, over_budget}
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # (statements are sequential on a connection; a failed statement's start
+    # time is simply overwritten by the next one)
+    conn.info['sql_stats_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info.pop('sql_stats_start', time.perf_counter())
+    if has_request_context() and 'sql_count' in g:
+        g.sql_count += 1
+        g.sql_time += duration
+
+
+def _before_request():
+    g.sql_count = 0
+    g.sql_time = 0.0
+
+
+def _after_request_handler(app):
+    def after_request(response):
+        if 'sql_count' not in g:
+            return response
+
+        count, db_time = g.sql_count, g.sql_time
+        endpoint = request.endpoint or 'unknown'
+        budget = app.config.get('SQL_QUERY_BUDGET', QUERY_BUDGET)
+        over_budget = count > budget
+
+        if app.config.get('SQL_STATS_HEADERS', app.debug):
+            response.headers['X-SQL-Queries'] = str(count)
+            response.headers['X-SQL-Time-Ms'] = '{:.2f}'.format(db_time * 1000)
+
+        if over_budget:
+            app.logger.warning(
+                '%s %s (%s) issued %d SQL statements (budget: %d) in %.2f ms',
+                request.method, request.path, endpoint, count, budget, db_time * 1000)
+
+        with _stats_lock:
+            stats = _stats.setdefault(endpoint, {
+                'requests': 0,
+                'queries': 0,
+                'max_queries': 0,
+                'db_time': 0.0,
+                'over_budget': 0
+            })
+            stats['requests'] += 1
+            stats['queries'] += count
+            stats['max_queries'] = max(stats['max_queries'], count)
+            stats['db_time'] += db_time
+            if over_budget:
+                stats['over_budget'] += 1
+
+        return response
+    return after_request
+
+
+def init_app(app):
+    """
+    Instruments the requests of a given app.
+    """
+    app.before_request(_before_request)
+    app.after_request(_after_request_handler(app))
+
+
+def get_stats():
+    """
+    Returns the SQL statistics of every endpoint (durations are in milliseconds):
+    {
+        endpoint: {
+            "requests": (int),
+            "queries": (int),
+            "avg_queries": (float),
+            "max_queries": (int),
+            "db_time_ms": (float),
+            "avg_db_time_ms": (float),
+            "over_budget": (int)
+        }
+    }
+    """
+    with _stats_lock:
+        return {endpoint: {
+            'requests': stats['requests'],
+            'queries': stats['queries'],
+            'avg_queries': stats['queries'] / stats['requests'],
+            'max_queries': stats['max_queries'],
+            'db_time_ms': stats['db_time'] * 1000,
+            'avg_db_time_ms': stats['db_time'] * 1000 / stats['requests'],
+            'over_budget': stats['over_budget']
+        } for endpoint, stats in _stats.items()}
+
+
+def reset():
+    with _stats_lock:
+        _stats.clear()
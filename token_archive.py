@@ -0,0 +1,113 @@
+# Archival of the finished tokens.
+#
+# Tokens are never deleted when guests are dequeued (their Status becomes -1),
+# so the Token table used to grow forever and every lookup on it (get_token,
+# the position in line and count SQL functions, the queue index loads) scanned
+# more and more history. Instead, finished tokens older than ARCHIVE_AFTER are
+# periodically moved to the TokenHistory table, in batches of BATCH_SIZE rows
+# (one short transaction per batch, so the Token table is never locked for
+# long), which keeps the Token table to the active tokens (plus the recent
+# ones).
+#
+# The job runs in a background thread of the API (every INTERVAL seconds, 0 to
+# disable it), started by the first request served (so not by the 'flask'
+# commands), and can also be run with 'flask archive-tokens'. Several workers
+# (or the command) may archive at the same time: dal.archive_tokens_batch()
+# never archives a token twice.
+
+import datetime
+import logging
+import os
+import threading
+
+import dal  # import data access layer
+
+
+logger = logging.getLogger(__name__)
+
+
+# Configuration (can be overridden with environment variables):
+ARCHIVE_AFTER = float(os.environ.get('TOKEN_ARCHIVE_AFTER', 24 * 3600))  # seconds
+BATCH_SIZE = int(os.environ.get('TOKEN_ARCHIVE_BATCH_SIZE', 1000))
+INTERVAL = float(os.environ.get('TOKEN_ARCHIVE_INTERVAL', 3600))  # seconds
+
+
+def archive_tokens(archive_after=ARCHIVE_AFTER, batch_size=BATCH_SIZE):
+    """
+    Moves every finished token taken more than 'archive_after' seconds ago
+    to the TokenHistory table (requires an app context).
+
+    Returns the number of archived tokens.
+    """
+    older_than = datetime.datetime.utcnow() - datetime.timedelta(seconds=archive_after)
+    archived_count = 0
+    while True:
+        count = dal.archive_tokens_batch(older_than, batch_size)
+        archived_count += count
+        if count < batch_size:
+            return archived_count
+
+
+class TokenArchiver:
+    """
+    Background thread running archive_tokens() every 'interval' seconds.
+    """
+
+    def __init__(self, app, interval=INTERVAL):
+        self.app = app
+        self.interval = interval
+        self.archived_count = 0
+        self.runs_count = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._work, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self):
+        from database import db
+        with self.app.app_context():
+            try:
+                self.archived_count += archive_tokens()
+                self.runs_count += 1
+            finally:
+                db.session.remove()
+
+    def _work(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Failed to archive tokens")
+
+
+# Archiver of the API:
+
+_archiver = None
+
+
+def start(app):
+    """
+    Starts archiving tokens in the background (unless INTERVAL is 0).
+    """
+    global _archiver
+    if INTERVAL > 0 and _archiver is None:
+        _archiver = TokenArchiver(app)
+        _archiver.start()
+    return _archiver
+
+
+def init_app(app):
+    """
+    Starts archiving tokens once a given app serves its first request.
+    """
+    app.before_first_request(lambda: start(app))
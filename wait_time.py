@@ -0,0 +1,137 @@
+# Adaptive estimation of the service time of each Queue.
+#
+# The time remaining of a guest used to be 'pos_in_line * ApproximateTimeOfService',
+# a static value typed in by the operator which drifts during the day. Instead,
+# the actual service durations (from the moment a guest is served to the moment
+# they are dequeued) are fed to an exponentially weighted moving average per
+# queue, updated in O(1) by the DAL on every serve/dequeue.
+#
+# Until a queue has MIN_SAMPLES observations (e.g., after a restart, since the
+# serve times are only kept in memory), its ApproximateTimeOfService is used.
+# Like the queue index, the estimator assumes a single API worker.
+
+import os
+import threading
+import time
+
+
+# Configuration (can be overridden with environment variables):
+# weight of the latest observation in the moving average:
+ALPHA = float(os.environ.get('WAIT_TIME_EWMA_ALPHA', 0.2))
+MIN_SAMPLES = int(os.environ.get('WAIT_TIME_MIN_SAMPLES', 3))
+# durations longer than this (in seconds) are outliers, e.g., a guest who was
+# never dequeued by the operator, and are ignored:
+MAX_SERVICE_TIME = float(os.environ.get('WAIT_TIME_MAX_SERVICE_TIME', 4 * 3600))
+# number of seconds in the unit of ApproximateTimeOfService (minutes):
+TIME_UNIT = float(os.environ.get('WAIT_TIME_UNIT', 60))
+
+
+class ServiceTimeEstimator:
+    """
+    Exponentially weighted moving average of the service durations of a queue.
+    """
+
+    def __init__(self, alpha=ALPHA):
+        self.alpha = alpha
+        self.average = None  # in seconds
+        self.samples = 0
+
+    def add(self, duration):
+        if self.average is None:
+            self.average = duration
+        else:
+            self.average += self.alpha * (duration - self.average)
+        self.samples += 1
+
+
+# queue_id -> ServiceTimeEstimator
+_estimators = {}
+# (queue_id, guest_id) -> time at which the guest has been served
+_served_at = {}
+# queue_id -> last ApproximateTimeOfService passed to get_service_time()
+_defaults = {}
+_lock = threading.Lock()
+
+
+def record_serve(queue_id, guest_id, now=None):
+    """
+    Records that a guest is being serviced.
+    """
+    if now is None:
+        now = time.monotonic()
+    with _lock:
+        _served_at[(queue_id, guest_id)] = now
+
+
+def record_dequeue(queue_id, guest_id, now=None):
+    """
+    Records that a guest has been dequeued, and adds their service duration
+    to the queue's estimate (if they were served by this process).
+    """
+    if now is None:
+        now = time.monotonic()
+    with _lock:
+        served_at = _served_at.pop((queue_id, guest_id), None)
+        if served_at is None:
+            return
+        duration = now - served_at
+        if 0 <= duration <= MAX_SERVICE_TIME:
+            _estimators.setdefault(queue_id, ServiceTimeEstimator()).add(duration)
+
+
+def close_queue(queue_id):
+    """
+    Forgets the guests being serviced in a closed queue (they have not been
+    dequeued individually: their durations are not meaningful).
+    """
+    with _lock:
+        for key in [key for key in _served_at if key[0] == queue_id]:
+            del _served_at[key]
+
+
+def get_service_time(queue_id, default):
+    """
+    Returns the estimated service time of a given queue (in the unit of
+    ApproximateTimeOfService), or 'default' if there are not enough samples.
+    """
+    with _lock:
+        _defaults[queue_id] = default
+        estimator = _estimators.get(queue_id)
+        if estimator is None or estimator.samples < MIN_SAMPLES:
+            return default
+        return estimator.average / TIME_UNIT
+
+
+def get_current_service_times():
+    """
+    Returns a dict {queue_id: service time} of the queues that have an
+    estimate, or whose ApproximateTimeOfService has been looked up.
+    """
+    with _lock:
+        service_times = dict(_defaults)
+        for queue_id, estimator in _estimators.items():
+            if estimator.samples >= MIN_SAMPLES:
+                service_times[queue_id] = estimator.average / TIME_UNIT
+        return service_times
+
+
+def reset(queue_id=None):
+    """
+    Drops the estimate of a given queue (or of all queues if queue_id is None).
+    """
+    with _lock:
+        if queue_id is None:
+            _estimators.clear()
+        else:
+            _estimators.pop(queue_id, None)
+
+
+def get_stats():
+    """
+    Returns {queue_id: {"samples": (int), "service_time": (float)}}.
+    """
+    with _lock:
+        return {queue_id: {
+            'samples': estimator.samples,
+            'service_time': estimator.average / TIME_UNIT
+        } for queue_id, estimator in _estimators.items()}